@@ -0,0 +1,454 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from gen import TARGETS, load_blacklists
+from gen_zig import generate_zig_code
+from parse_tablegen import CHUNK_SIZE, TablegenParser, resolve_details
+from parse_tablegen_json import compare_frontends
+
+# Synthetic cases. The first four are roughly shaped like the largest LLVM 9 targets,
+# "large" stresses scaling well past what any current target defines.
+SYNTHETIC_CASES = {
+    "aarch64": {"feature_count": 130, "cpu_count": 45, "density": 4, "blacklist_size": 30},
+    "amdgpu": {"feature_count": 180, "cpu_count": 60, "density": 6, "blacklist_size": 0},
+    "arm": {"feature_count": 190, "cpu_count": 90, "density": 4, "blacklist_size": 80},
+    "x86": {"feature_count": 160, "cpu_count": 90, "density": 3, "blacklist_size": 5},
+    "large": {"feature_count": 3000, "cpu_count": 400, "density": 6, "blacklist_size": 300},
+}
+
+STAGES = ["parse", "resolve", "emit"]
+
+# Matching --dump-json and --gen-subtarget outputs checked in under fixtures/, which both
+# frontends must resolve identically, along with the blacklists to check them with.
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FRONTEND_FIXTURES = [
+    ("toy_dump.json", "toy_tablegen.cpp", [[], ["ProcFamilyX"]]),
+]
+
+# Chunk sizes the JSON frontend is fed in, down to single bytes, so that values cut off
+# anywhere are covered.
+FIXTURE_CHUNK_SIZES = [1, 7, 4096, CHUNK_SIZE]
+
+# Synthetic CPU names cycle through these, so that CPU family sharding has families to split.
+SYNTHETIC_CPU_FAMILIES = ["core", "cortex", "exynos", "gfx", "neoverse", "power", "sparc", "znver"]
+
+
+class Case:
+    def __init__(self, name, arch_name, tablegen_text, blacklist):
+        self.name = name
+        self.arch_name = arch_name
+        self.tablegen_text = tablegen_text
+        self.blacklist = blacklist
+
+
+def synthesize_tablegen(arch_name, feature_count, cpu_count, density, blacklist_size, tune=False, seed=0):
+    # Generates text shaped like `llvm-tblgen --gen-subtarget` output, along with a blacklist.
+    # Blacklisted defs stand in for processor families and sub-architectures: they imply several
+    # other features, including other blacklisted defs, so blacklist collapsing has work to do.
+    # Returns (text, blacklist).
+    rng = random.Random(seed)
+
+    blacklist_size = min(blacklist_size, feature_count)
+    def_names = ["Proc{:04d}".format(i) for i in range(blacklist_size)]
+    def_names += ["Feature{:04d}".format(i) for i in range(feature_count - blacklist_size)]
+
+    # Enum values are assigned in def name order.
+    def_names.sort()
+
+    llvm_names = {}
+    for def_name in def_names:
+        number = def_name[-4:].lstrip("0") or "0"
+        if def_name.startswith("Proc"):
+            llvm_names[def_name] = "proc-" + number
+        else:
+            llvm_names[def_name] = rng.choice(["ext-", "v8.", "i", "has-", "x"]) + number
+
+    # Dependencies only point backwards in a random topological order, so there are no cycles.
+    order = list(range(feature_count))
+    rng.shuffle(order)
+
+    dependencies = [set() for _ in range(feature_count)]
+    for i, feature_id in enumerate(order):
+        if i == 0:
+            continue
+
+        dep_count = rng.randint(0, density)
+        if def_names[feature_id].startswith("Proc"):
+            dep_count *= 3
+
+        for _ in range(dep_count):
+            dependencies[feature_id].add(order[rng.randrange(i)])
+
+    # A few features have no command line name, and so no feature table entry.
+    hidden = set(rng.sample(range(feature_count), feature_count // 50))
+
+    word_count = max(3, (feature_count + 63) // 64)
+
+    def bitmap(ids):
+        words = [0] * word_count
+        for feature_id in ids:
+            words[feature_id // 64] |= 1 << (feature_id % 64)
+        return "{ { { " + " ".join("0x{:x}ULL,".format(word) for word in words) + " } } }"
+
+    lines = [
+        "#ifdef GET_SUBTARGETINFO_ENUM",
+        "#undef GET_SUBTARGETINFO_ENUM",
+        "",
+        "namespace llvm {",
+        "namespace {} {{".format(arch_name),
+        "enum {",
+    ]
+    lines += ["  {} = {},".format(def_name, i) for i, def_name in enumerate(def_names)]
+    lines += [
+        "  NumSubtargetFeatures = {}".format(feature_count),
+        "};",
+        "} // end namespace " + arch_name,
+        "} // end namespace llvm",
+        "",
+        "#endif // GET_SUBTARGETINFO_ENUM",
+        "",
+        "#ifdef GET_SUBTARGETINFO_MC_DESC",
+        "#undef GET_SUBTARGETINFO_MC_DESC",
+        "",
+        "namespace llvm {",
+        "// Sorted (by key) array of values for CPU features.",
+        "extern const llvm::SubtargetFeatureKV {}FeatureKV[] = {{".format(arch_name),
+    ]
+
+    rows = sorted((llvm_names[def_name], i) for i, def_name in enumerate(def_names) if i not in hidden)
+    for llvm_name, feature_id in rows:
+        lines.append('  {{ "{}", "Enable {} instructions", {}::{}, {} }},'.format(
+            llvm_name, llvm_name, arch_name, def_names[feature_id], bitmap(dependencies[feature_id])))
+
+    lines.append("};")
+    lines.append("")
+
+    # Scheduling model tables, which the parser has to skip over.
+    for i in range(cpu_count * 20):
+        lines.append("static const llvm::MCWriteProcResEntry {}WriteProcResTable{}[] = {{".format(arch_name, i))
+        lines.append("  { 0,  0,  0}, // Invalid")
+        lines.append("}}; // {}WriteProcResTable{}".format(arch_name, i))
+
+    lines.append("")
+    lines.append("// Sorted (by key) array of values for CPU subtype.")
+    lines.append("extern const llvm::SubtargetSubTypeKV {}SubTypeKV[] = {{".format(arch_name))
+
+    cpu_names = sorted("{}-{}".format(SYNTHETIC_CPU_FAMILIES[i % len(SYNTHETIC_CPU_FAMILIES)], i) for i in range(cpu_count))
+    for cpu_name in cpu_names:
+        features = rng.sample(range(feature_count), min(feature_count, density * 4))
+        row = ' {{ "{}", {}'.format(cpu_name, bitmap(features))
+        if tune:
+            row += ", " + bitmap(rng.sample(range(feature_count), min(feature_count, 2)))
+        lines.append(row + ", &{}Model }},".format(arch_name))
+
+    lines.append("};")
+    lines.append("")
+
+    for i in range(cpu_count * 20):
+        lines.append("static const unsigned {}ReadAdvanceTable{}[] = {{ 0, 0 }};".format(arch_name, i))
+
+    lines.append("} // end namespace llvm")
+    lines.append("#endif // GET_SUBTARGETINFO_MC_DESC")
+
+    blacklist = [def_name for def_name in def_names if def_name.startswith("Proc")]
+
+    return "\n".join(lines) + "\n", blacklist
+
+
+def replay_cases(replay_dir, blacklists):
+    # Cases for real tablegen outputs captured in a work or cache dir.
+    targets_by_output_name = {target.output_name: target for target in TARGETS}
+
+    paths = glob.glob(os.path.join(replay_dir, "*_tablegen.cpp"))
+    paths += glob.glob(os.path.join(replay_dir, "tablegen", "*_tablegen.cpp"))
+
+    cases = []
+    for path in sorted(paths):
+        # Either <arch>_tablegen.cpp or a cache entry named <arch>-<key>_tablegen.cpp.
+        stem = os.path.basename(path)[:-len("_tablegen.cpp")]
+        output_name, _, key = stem.partition("-")
+
+        target = targets_by_output_name.get(output_name)
+        if target is None:
+            print("[!] Skipping {}: unknown arch".format(path), file=sys.stderr)
+            continue
+
+        with open(path, "r") as f:
+            text = f.read()
+
+        name = "replay:" + output_name
+        if len(key) > 0:
+            name += "-" + key[:8]
+
+        cases.append(Case(name, output_name, text, blacklists[target.target_dir]))
+
+    return cases
+
+
+def run_stages(case):
+    # Runs the pipeline once, returning (per-stage durations in seconds, output size in bytes).
+    durations = {}
+
+    start = time.perf_counter()
+    parser = TablegenParser()
+    text = case.tablegen_text
+    for offset in range(0, len(text), CHUNK_SIZE):
+        parser.feed(text[offset:offset + CHUNK_SIZE])
+        if parser.done:
+            break
+    features, cpus = parser.finish()
+    durations["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    target_details = resolve_details(features, cpus, case.blacklist)
+    durations["resolve"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    zig_out = io.StringIO()
+    generate_zig_code(zig_out, case.arch_name, target_details)
+    output = zig_out.getvalue()
+    durations["emit"] = time.perf_counter() - start
+
+    return durations, len(output.encode()), target_details
+
+
+def measure_case(case, repeat):
+    # Best-of-`repeat` durations per stage, plus peak traced memory per stage from a separate run
+    # (tracing allocations slows everything down, so it is kept out of the timed runs).
+    best = {stage: float("inf") for stage in STAGES}
+    for _ in range(repeat):
+        durations, output_size, target_details = run_stages(case)
+        for stage in STAGES:
+            best[stage] = min(best[stage], durations[stage])
+
+    peaks = {}
+    tracemalloc.start()
+    try:
+        parser = TablegenParser()
+        parser.feed(case.tablegen_text)
+        features, cpus = parser.finish()
+        peaks["parse"] = tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.reset_peak()
+        details = resolve_details(features, cpus, case.blacklist)
+        peaks["resolve"] = tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.reset_peak()
+        generate_zig_code(io.StringIO(), case.arch_name, details)
+        peaks["emit"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    record_count = target_details.feature_count + target_details.cpu_count
+    throughputs = {
+        "parse": "{:.1f} MB/s".format(len(case.tablegen_text.encode()) / best["parse"] / 1e6),
+        "resolve": "{:.0f} rec/s".format(record_count / best["resolve"]),
+        "emit": "{:.1f} MB/s".format(output_size / best["emit"] / 1e6),
+    }
+
+    return {stage: {"seconds": best[stage], "throughput": throughputs[stage], "peak_bytes": peaks[stage]} for stage in STAGES}, target_details
+
+
+def measure_sizes(case, target_details):
+    # Sizes in bytes of the Zig output as one file, and with CPUs split into family files:
+    # the arch file, the family files, and the most a build referencing a single CPU analyzes
+    # (the arch file plus the largest family file), and the single file with shared feature sets
+    # interned.
+    monolithic_out = io.StringIO()
+    generate_zig_code(monolithic_out, case.arch_name, target_details)
+
+    interned_out = io.StringIO()
+    generate_zig_code(interned_out, case.arch_name, target_details, intern_feature_sets=True)
+
+    arch_out = io.StringIO()
+    cpu_files = {}
+    generate_zig_code(arch_out, case.arch_name, target_details, cpu_files=cpu_files)
+
+    arch_size = len(arch_out.getvalue().encode())
+    cpu_file_sizes = [len(text.encode()) for text in cpu_files.values()]
+
+    return {
+        "monolithic_bytes": len(monolithic_out.getvalue().encode()),
+        "arch_bytes": arch_size,
+        "cpu_file_count": len(cpu_file_sizes),
+        "largest_cpu_file_bytes": max(cpu_file_sizes, default=0),
+        "single_cpu_bytes": arch_size + max(cpu_file_sizes, default=0),
+        "interned_bytes": len(interned_out.getvalue().encode()),
+    }
+
+
+def check_fixtures():
+    # Checks that both frontends agree on every fixture. Returns the names of those that don't.
+    failed = []
+    for dump_json_name, subtarget_name, blacklists in FRONTEND_FIXTURES:
+        for blacklist in blacklists:
+            for chunk_size in FIXTURE_CHUNK_SIZES:
+                differences = compare_frontends(
+                    os.path.join(FIXTURE_DIR, dump_json_name), os.path.join(FIXTURE_DIR, subtarget_name), blacklist, chunk_size)
+                if len(differences) > 0:
+                    name = "{} (blacklist {}, chunk size {})".format(dump_json_name, blacklist, chunk_size)
+                    print("[!] Frontends disagree on {}!".format(name), file=sys.stderr)
+                    for line in differences:
+                        print("    " + line, file=sys.stderr)
+                    failed.append(name)
+
+    return failed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the tablegen parser, dependency resolver and Zig emitter. Runs offline on synthetic inputs.",
+        allow_abbrev=False)
+
+    arg_parser.add_argument(
+        "-cases",
+        default=",".join(SYNTHETIC_CASES),
+        help="(default: all) comma-separated synthetic cases to run, from: " + ", ".join(SYNTHETIC_CASES))
+    arg_parser.add_argument(
+        "-synthetic",
+        action="append",
+        default=[],
+        metavar="FEATURES:CPUS:DENSITY:BLACKLIST",
+        help="add a custom synthetic case (may be repeated)")
+    arg_parser.add_argument(
+        "-tune",
+        action="store_true",
+        help="(default: false) synthesize CPU rows with tune feature bitmaps, as newer LLVM versions do")
+    arg_parser.add_argument(
+        "-replay",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="also benchmark real tablegen outputs (*_tablegen.cpp) found in a work or cache dir (may be repeated)")
+    arg_parser.add_argument(
+        "-blacklist",
+        default=None,
+        help="(default: <none>) blacklist file to use for replayed outputs")
+    arg_parser.add_argument(
+        "-repeat",
+        type=int,
+        default=5,
+        help="(default: 5) number of timed runs per case; the fastest is reported")
+    arg_parser.add_argument(
+        "-baseline",
+        default=None,
+        help="(default: <none>) compare against a baseline written by -save-baseline, and fail on regressions")
+    arg_parser.add_argument(
+        "-threshold",
+        type=float,
+        default=0.25,
+        help="(default: 0.25) relative slowdown against the baseline that counts as a regression")
+    arg_parser.add_argument(
+        "-save-baseline",
+        default=None,
+        help="(default: <none>) write results to this file, for later use with -baseline")
+
+    args = arg_parser.parse_args()
+
+    if len(check_fixtures()) > 0:
+        sys.exit(1)
+    print("= Frontends agree on all fixtures")
+
+    cases = []
+    for name in filter(None, args.cases.split(",")):
+        if name not in SYNTHETIC_CASES:
+            print("[!] Unknown case '{}'!".format(name), file=sys.stderr)
+            sys.exit(1)
+
+        text, blacklist = synthesize_tablegen(name, tune=args.tune, **SYNTHETIC_CASES[name])
+        cases.append(Case(name, name, text, blacklist))
+
+    for spec in args.synthetic:
+        try:
+            feature_count, cpu_count, density, blacklist_size = (int(part) for part in spec.split(":"))
+        except ValueError:
+            print("[!] Invalid -synthetic spec '{}'!".format(spec), file=sys.stderr)
+            sys.exit(1)
+
+        text, blacklist = synthesize_tablegen("synthetic", feature_count, cpu_count, density, blacklist_size, tune=args.tune)
+        cases.append(Case("synthetic-" + spec.replace(":", "-"), "synthetic", text, blacklist))
+
+    if len(args.replay) > 0:
+        blacklists = load_blacklists(args.blacklist)
+        for replay_dir in args.replay:
+            cases += replay_cases(replay_dir, blacklists)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)["cases"]
+
+    results = {}
+    sizes = {}
+    regressions = []
+
+    print("{:<32} {:<8} {:>10} {:>14} {:>10} {:>10}".format("case", "stage", "time (ms)", "throughput", "peak (KB)", "baseline"))
+
+    for case in cases:
+        results[case.name], target_details = measure_case(case, args.repeat)
+        sizes[case.name] = measure_sizes(case, target_details)
+
+        for stage in STAGES:
+            result = results[case.name][stage]
+
+            comparison = ""
+            if baseline is not None and case.name in baseline:
+                ratio = result["seconds"] / baseline[case.name][stage]["seconds"]
+                comparison = "{:+.0f}%".format((ratio - 1) * 100)
+                if ratio > 1 + args.threshold:
+                    comparison += " !"
+                    regressions.append("{} {}".format(case.name, stage))
+
+            print("{:<32} {:<8} {:>10.2f} {:>14} {:>10.0f} {:>10}".format(
+                case.name, stage, result["seconds"] * 1000, result["throughput"], result["peak_bytes"] / 1024, comparison))
+
+    print()
+    print("{:<32} {:>15} {:>10} {:>10} {:>16} {:>15} {:>15}".format(
+        "case", "monolithic (KB)", "arch (KB)", "cpu files", "largest cpu (KB)", "one cpu (KB)", "interned (KB)"))
+
+    for case in cases:
+        size = sizes[case.name]
+        print("{:<32} {:>15.1f} {:>10.1f} {:>10} {:>16.1f} {:>15.1f} {:>15.1f}".format(
+            case.name, size["monolithic_bytes"] / 1024, size["arch_bytes"] / 1024, size["cpu_file_count"],
+            size["largest_cpu_file_bytes"] / 1024, size["single_cpu_bytes"] / 1024, size["interned_bytes"] / 1024))
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({"cases": results, "sizes": sizes}, baseline_file, indent=4)
+
+    if len(regressions) > 0:
+        print("[!] Regressions beyond {:.0f}%: {}".format(args.threshold * 100, ", ".join(regressions)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Blacklisted feature def names of one arch.
+#
+# Entries are exact def names (e.g. ARMv8_5a), glob patterns (any entry containing *, ? or [,
+# e.g. ARMv8_*) or regular expressions (prefixed with "re:", e.g. re:ARMv8_\d+a). Exact names
+# are looked up in a hash set; all patterns are compiled into a single regex, so matching a
+# def name costs one lookup and at most one regex match however long the blacklist is. Patterns
+# that are valid alone but not once joined (e.g. inline global flags such as (?i), or a group
+# name used twice) are instead matched one by one.
+
+import fnmatch
+import re
+
+GLOB_CHARS = "*?["
+REGEX_PREFIX = "re:"
+
+
+def entry_regex(entry):
+    # Returns the regex source matching a pattern entry, or None if the entry is an exact name.
+    if entry.startswith(REGEX_PREFIX):
+        return entry[len(REGEX_PREFIX):]
+    if any(char in entry for char in GLOB_CHARS):
+        return fnmatch.translate(entry)
+    return None
+
+
+class Blacklist:
+    def __init__(self, entries=()):
+        self.names = set()
+        self.patterns = []
+        self._regexes = []
+        self._compiled = []
+        self._matchers = None
+
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        # Adds an exact name or pattern. Raises re.error if a pattern is not a valid regex.
+        regex = entry_regex(entry)
+        if regex is None:
+            self.names.add(entry)
+            return
+
+        self._compiled.append(re.compile(regex))
+        self.patterns.append(entry)
+        self._regexes.append(regex)
+        self._matchers = None
+
+    def _match(self, def_name):
+        if len(self._regexes) == 0:
+            return False
+
+        if self._matchers is None:
+            try:
+                self._matchers = [re.compile("|".join("(?:{})".format(regex) for regex in self._regexes))]
+            except re.error:
+                self._matchers = list(self._compiled)
+        return any(matcher.fullmatch(def_name) is not None for matcher in self._matchers)
+
+    def __contains__(self, def_name):
+        return def_name in self.names or self._match(def_name)
+
+    def __iter__(self):
+        # Every entry as written, so that sorted(blacklist) identifies the blacklist in digests.
+        yield from self.names
+        yield from self.patterns
+
+    def __len__(self):
+        return len(self.names) + len(self.patterns)
+
+    def mask(self, features):
+        # Bitmask, by feature id, of the given parse_tablegen.Features that are blacklisted.
+        mask = 0
+        for feature in features:
+            if feature.def_name in self:
+                mask |= 1 << feature.id
+        return mask
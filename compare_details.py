@@ -0,0 +1,186 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from parse_tablegen import iter_set_bits
+
+
+class FeatureSpace:
+    # Assigns a bit to every feature LLVM name seen in either of two versions of a target, so
+    # that their feature sets can be compared as plain integers even though feature indices
+    # differ between versions. Old features keep their own indices as bits where possible, and
+    # so do new ones if the feature list is unchanged, in which case masks need no remapping.
+
+    def __init__(self, old_details, new_details):
+        bit_by_name = {}
+        for name in old_details.feature_llvm_names + new_details.feature_llvm_names:
+            bit_by_name.setdefault(name, len(bit_by_name))
+        self.names = list(bit_by_name)
+
+        # None where a version's feature indices are already its bits.
+        self.old_bits = self._bits(bit_by_name, old_details.feature_llvm_names)
+        self.new_bits = self._bits(bit_by_name, new_details.feature_llvm_names)
+
+    @staticmethod
+    def _bits(bit_by_name, names):
+        bits = [bit_by_name[name] for name in names]
+        return None if bits == list(range(len(bits))) else bits
+
+    @staticmethod
+    def _remap(bits, mask):
+        if bits is None:
+            return mask
+
+        remapped = 0
+        for index in iter_set_bits(mask):
+            remapped |= 1 << bits[index]
+        return remapped
+
+    def old_mask(self, mask):
+        return self._remap(self.old_bits, mask)
+
+    def new_mask(self, mask):
+        return self._remap(self.new_bits, mask)
+
+    def names_of(self, mask):
+        return sorted(self.names[bit] for bit in iter_set_bits(mask))
+
+
+class DetailsChanges:
+    # Differences between two versions of a target's details. Features and CPUs are matched
+    # by LLVM name; changed entries map names to (added dependencies, removed dependencies),
+    # and features whose description changed are listed separately.
+
+    def __init__(self):
+        self.features_added = []
+        self.features_removed = []
+        self.features_changed = {}
+        self.descriptions_changed = []
+
+        self.cpus_added = []
+        self.cpus_removed = []
+        self.cpus_changed = {}
+
+    @property
+    def empty(self):
+        return not (
+            self.features_added or self.features_removed or self.features_changed or self.descriptions_changed or
+            self.cpus_added or self.cpus_removed or self.cpus_changed)
+
+    def format(self):
+        lines = []
+
+        def format_deps(added, removed):
+            parts = []
+            if added:
+                parts.append("+" + " +".join(added))
+            if removed:
+                parts.append("-" + " -".join(removed))
+            return " ".join(parts)
+
+        for name in self.features_added:
+            lines.append("  + feature {}".format(name))
+        for name in self.features_removed:
+            lines.append("  - feature {}".format(name))
+        for name in sorted(set(self.features_changed) | set(self.descriptions_changed)):
+            parts = []
+            if name in self.features_changed:
+                parts.append(format_deps(*self.features_changed[name]))
+            if name in self.descriptions_changed:
+                parts.append("(description changed)")
+            lines.append("  ~ feature {}: {}".format(name, " ".join(parts)))
+
+        for name in self.cpus_added:
+            lines.append("  + cpu {}".format(name))
+        for name in self.cpus_removed:
+            lines.append("  - cpu {}".format(name))
+        for name in sorted(self.cpus_changed):
+            lines.append("  ~ cpu {}: {}".format(name, format_deps(*self.cpus_changed[name])))
+
+        return lines
+
+
+def _compare_named(space, old_names, old_masks, new_names, new_masks, added, removed, changed):
+    # Compares two name -> dependency mask tables, with both sides' dependencies remapped into
+    # the shared feature space. Returns the names present on both sides.
+    old_by_name = dict(zip(old_names, old_masks))
+    new_by_name = dict(zip(new_names, new_masks))
+
+    added.extend(sorted(name for name in new_by_name if name not in old_by_name))
+    removed.extend(sorted(name for name in old_by_name if name not in new_by_name))
+
+    common = sorted(name for name in new_by_name if name in old_by_name)
+    for name in common:
+        old_mask = space.old_mask(old_by_name[name])
+        new_mask = space.new_mask(new_by_name[name])
+        if old_mask != new_mask:
+            changed[name] = (space.names_of(new_mask & ~old_mask), space.names_of(old_mask & ~new_mask))
+
+    return common
+
+
+def compare_details(old_details, new_details):
+    # Computes the DetailsChanges going from `old_details` to `new_details`.
+    space = FeatureSpace(old_details, new_details)
+    changes = DetailsChanges()
+
+    common_features = _compare_named(
+        space,
+        old_details.feature_llvm_names, old_details.feature_dependency_masks,
+        new_details.feature_llvm_names, new_details.feature_dependency_masks,
+        changes.features_added, changes.features_removed, changes.features_changed)
+
+    old_descriptions = dict(zip(old_details.feature_llvm_names, old_details.feature_descriptions))
+    new_descriptions = dict(zip(new_details.feature_llvm_names, new_details.feature_descriptions))
+    changes.descriptions_changed = [name for name in common_features if old_descriptions[name] != new_descriptions[name]]
+
+    _compare_named(
+        space,
+        old_details.cpu_llvm_names, old_details.cpu_dependency_masks,
+        new_details.cpu_llvm_names, new_details.cpu_dependency_masks,
+        changes.cpus_added, changes.cpus_removed, changes.cpus_changed)
+
+    return changes
+
+
+def format_change_report(arch_versions):
+    # Formats a report of the changes between consecutive versions of each arch.
+    # `arch_versions` maps arch names to lists of (version label, TargetDetails or None), in
+    # version order; versions where the arch failed (None) are skipped.
+    lines = []
+
+    for arch_name, versions in arch_versions.items():
+        versions = [(label, details) for label, details in versions if details is not None]
+
+        for (old_label, old_details), (new_label, new_details) in zip(versions, versions[1:]):
+            lines.append("= {}: {} -> {}".format(arch_name, old_label, new_label))
+
+            if old_details is new_details:
+                lines.append("  (identical)")
+                continue
+
+            changes = compare_details(old_details, new_details)
+            if changes.empty:
+                lines.append("  (no changes)")
+            else:
+                lines.extend(changes.format())
+
+    return lines
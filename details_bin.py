@@ -0,0 +1,246 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Binary representation of a target's details.
+#
+# All integers are little-endian. The file consists of:
+#   header            see HEADER below; section offsets are from the start of the file
+#   string table      UTF-8 strings, not terminated, each stored once
+#   feature records   per feature: (offset, length) of its def name, LLVM name and description,
+#                     then (offset, length) of its dependency order
+#   CPU records       per CPU: (offset, length) of its LLVM name, then of its dependency order
+#   feature order     u32 feature indices sorted by LLVM name, for lookups by name
+#   CPU order         u32 CPU indices sorted by LLVM name
+#   feature bitsets   per feature: dependency bitset of `word_count` u64 words, by feature index
+#   CPU bitsets       per CPU: dependency bitset
+#   dependency orders u32 feature indices
+#
+# Dependency lists are mostly in feature index order, in which case the bitset holds the list
+# exactly and its dependency order is empty. Lists that blacklist collapsing put in a different
+# order also have it spelled out in the dependency orders section.
+
+import mmap
+import os
+import struct
+import sys
+
+from parse_tablegen import TargetDetails, iter_set_bits
+
+MAGIC = b"ZTDB"
+FORMAT_VERSION = 1
+
+# magic, format version, word count, feature count, CPU count, then offsets of the string table,
+# feature records, CPU records, feature order, CPU order, feature bitsets, CPU bitsets and
+# dependency orders.
+HEADER = struct.Struct("<4sHHII8I")
+FEATURE_RECORD = struct.Struct("<8I")
+CPU_RECORD = struct.Struct("<4I")
+INDEX = struct.Struct("<I")
+
+
+def details_to_bin(target_details):
+    # Encodes a TargetDetails as bytes.
+    strings = bytearray()
+    string_refs = {}
+
+    def add_string(string):
+        ref = string_refs.get(string)
+        if ref is None:
+            data = string.encode()
+            ref = (len(strings), len(data))
+            strings.extend(data)
+            string_refs[string] = ref
+        return ref
+
+    dependency_orders = bytearray()
+
+    def add_order(deps):
+        if all(deps[i] < deps[i + 1] for i in range(len(deps) - 1)):
+            return (0, 0)
+
+        offset = len(dependency_orders) // INDEX.size
+        for dep in deps:
+            dependency_orders.extend(INDEX.pack(dep))
+        return (offset, len(deps))
+
+    feature_records = bytearray()
+    for i in range(target_details.feature_count):
+        feature_records += FEATURE_RECORD.pack(
+            *add_string(target_details.feature_def_names[i]),
+            *add_string(target_details.feature_llvm_names[i]),
+            *add_string(target_details.feature_descriptions[i]),
+            *add_order(target_details.feature_dependencies[i]))
+
+    cpu_records = bytearray()
+    for i in range(target_details.cpu_count):
+        cpu_records += CPU_RECORD.pack(
+            *add_string(target_details.cpu_llvm_names[i]),
+            *add_order(target_details.cpu_dependencies[i]))
+
+    def name_order(names):
+        return b"".join(INDEX.pack(i) for i in sorted(range(len(names)), key=names.__getitem__))
+
+    feature_order = name_order(target_details.feature_llvm_names)
+    cpu_order = name_order(target_details.cpu_llvm_names)
+
+    word_count = max(1, (target_details.feature_count + 63) // 64)
+    bitset_size = word_count * 8
+
+    def bitsets(masks):
+        return b"".join(mask.to_bytes(bitset_size, "little") for mask in masks)
+
+    feature_bitsets = bitsets(target_details.feature_dependency_masks)
+    cpu_bitsets = bitsets(target_details.cpu_dependency_masks)
+
+    sections = [strings, feature_records, cpu_records, feature_order, cpu_order, feature_bitsets, cpu_bitsets, dependency_orders]
+
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, word_count, target_details.feature_count, target_details.cpu_count, *offsets)
+
+    return b"".join([header] + [bytes(section) for section in sections])
+
+
+class DetailsFile:
+    # Read-only view of a binary details file. The file is memory-mapped and records are only
+    # decoded when asked for, so looking up a single feature or CPU touches little of the file.
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            # Checked before mapping, as an empty file cannot be mapped.
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                print("[!] Truncated details file {}!".format(path), file=sys.stderr)
+                sys.exit(1)
+
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.word_count, self.feature_count, self.cpu_count,
+            self._strings, self._features, self._cpus, self._feature_order, self._cpu_order,
+            self._feature_bitsets, self._cpu_bitsets, self._dependency_orders) = HEADER.unpack_from(self._mmap, 0)
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            print("[!] {} is not a version {} details file!".format(path, FORMAT_VERSION), file=sys.stderr)
+            sys.exit(1)
+
+        self._bitset_size = self.word_count * 8
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string(self, offset, length):
+        start = self._strings + offset
+        return self._mmap[start:start + length].decode()
+
+    def _feature_record(self, index):
+        return FEATURE_RECORD.unpack_from(self._mmap, self._features + index * FEATURE_RECORD.size)
+
+    def _cpu_record(self, index):
+        return CPU_RECORD.unpack_from(self._mmap, self._cpus + index * CPU_RECORD.size)
+
+    def _bitset(self, base, index):
+        start = base + index * self._bitset_size
+        return int.from_bytes(self._mmap[start:start + self._bitset_size], "little")
+
+    def _dependencies(self, bitset_base, index, order_offset, order_length):
+        if order_length == 0:
+            return tuple(iter_set_bits(self._bitset(bitset_base, index)))
+
+        start = self._dependency_orders + order_offset * INDEX.size
+        return struct.unpack_from("<{}I".format(order_length), self._mmap, start)
+
+    def feature_def_name(self, index):
+        return self._string(*self._feature_record(index)[0:2])
+
+    def feature_llvm_name(self, index):
+        return self._string(*self._feature_record(index)[2:4])
+
+    def feature_description(self, index):
+        return self._string(*self._feature_record(index)[4:6])
+
+    def feature_dependency_mask(self, index):
+        return self._bitset(self._feature_bitsets, index)
+
+    def feature_dependencies(self, index):
+        # Dependency list in emission order.
+        return self._dependencies(self._feature_bitsets, index, *self._feature_record(index)[6:8])
+
+    def cpu_llvm_name(self, index):
+        return self._string(*self._cpu_record(index)[0:2])
+
+    def cpu_dependency_mask(self, index):
+        return self._bitset(self._cpu_bitsets, index)
+
+    def cpu_dependencies(self, index):
+        # Dependency list in emission order.
+        return self._dependencies(self._cpu_bitsets, index, *self._cpu_record(index)[2:4])
+
+    def _find(self, order_offset, count, name_of, llvm_name):
+        # Binary search over indices sorted by LLVM name.
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            index = INDEX.unpack_from(self._mmap, order_offset + middle * INDEX.size)[0]
+            name = name_of(index)
+            if name == llvm_name:
+                return index
+            if name < llvm_name:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def find_feature(self, llvm_name):
+        # Returns the index of the feature with the given LLVM name, or None.
+        return self._find(self._feature_order, self.feature_count, self.feature_llvm_name, llvm_name)
+
+    def find_cpu(self, llvm_name):
+        # Returns the index of the CPU with the given LLVM name, or None.
+        return self._find(self._cpu_order, self.cpu_count, self.cpu_llvm_name, llvm_name)
+
+    def to_details(self):
+        # Decodes the whole file into a TargetDetails.
+        details = TargetDetails()
+
+        for i in range(self.feature_count):
+            details.add_feature(
+                sys.intern(self.feature_def_name(i)),
+                sys.intern(self.feature_llvm_name(i)),
+                self.feature_description(i),
+                self.feature_dependencies(i))
+
+        for i in range(self.cpu_count):
+            details.add_cpu(sys.intern(self.cpu_llvm_name(i)), self.cpu_dependencies(i))
+
+        return details
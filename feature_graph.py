@@ -0,0 +1,153 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import sys
+
+from parse_tablegen import TargetDetails, indices_to_mask, iter_set_bits
+
+
+def dependency_order(feature_dependencies):
+    # Orders feature indices so that, cycles aside, every feature comes after its dependencies.
+    order = []
+    visited = [False] * len(feature_dependencies)
+
+    for root in range(len(feature_dependencies)):
+        if visited[root]:
+            continue
+
+        visited[root] = True
+        stack = [(root, iter(feature_dependencies[root]))]
+        while stack:
+            feature, deps = stack[-1]
+            for dep in deps:
+                if not visited[dep]:
+                    visited[dep] = True
+                    stack.append((dep, iter(feature_dependencies[dep])))
+                    break
+            else:
+                stack.pop()
+                order.append(feature)
+
+    return order
+
+
+def feature_closures(target_details):
+    # Returns, for each feature index, a bitmask of every feature it transitively depends on.
+    # A feature's own bit is only set if it is part of a dependency cycle.
+    feature_dependencies = target_details.feature_dependencies
+    dependency_masks = target_details.feature_dependency_masks
+    closures = [0] * len(feature_dependencies)
+
+    # In dependency order a single pass suffices for an acyclic graph; cycles need more passes,
+    # and the last pass only confirms nothing changed.
+    order = dependency_order(feature_dependencies)
+    changed = True
+    while changed:
+        changed = False
+        for feature in order:
+            closure = dependency_masks[feature]
+            for dep in feature_dependencies[feature]:
+                closure |= closures[dep]
+
+            if closure != closures[feature]:
+                closures[feature] = closure
+                changed = True
+
+    return closures
+
+
+def closure_of(mask, closures):
+    # Bitmask of the features in `mask` and everything they transitively depend on.
+    closure = mask
+    for dep in iter_set_bits(mask):
+        closure |= closures[dep]
+    return closure
+
+
+def reduce_dependencies(deps, closures):
+    # Drops every dependency that another remaining dependency already implies, keeping the
+    # rest in their original order. Dependencies are dropped one at a time, so that of several
+    # features implying each other (a cycle), one is kept.
+    kept = list(deps)
+    for dep in deps:
+        bit = 1 << dep
+        if any(other != dep and closures[other] & bit for other in kept):
+            kept.remove(dep)
+
+    return kept
+
+
+def reduce_details(target_details):
+    # Returns a copy of target_details where each feature's and CPU's dependency list is reduced
+    # to its transitive reduction, along with the number of dependency entries before and after.
+    # The full closure of every list is checked to be unchanged.
+    closures = feature_closures(target_details)
+
+    reduced = TargetDetails()
+    before = 0
+    after = 0
+
+    def reduce(deps, mask):
+        nonlocal before, after
+
+        kept = reduce_dependencies(deps, closures)
+        if closure_of(indices_to_mask(kept), closures) != closure_of(mask, closures):
+            print("[!] Dependency reduction changed a dependency closure (internal error)!", file=sys.stderr)
+            sys.exit(1)
+
+        before += len(deps)
+        after += len(kept)
+        return kept
+
+    for feature in range(target_details.feature_count):
+        reduced.add_feature(
+            target_details.feature_def_names[feature],
+            target_details.feature_llvm_names[feature],
+            target_details.feature_descriptions[feature],
+            reduce(target_details.feature_dependencies[feature], target_details.feature_dependency_masks[feature]))
+
+    for cpu in range(target_details.cpu_count):
+        reduced.add_cpu(
+            target_details.cpu_llvm_names[cpu],
+            reduce(target_details.cpu_dependencies[cpu], target_details.cpu_dependency_masks[cpu]))
+
+    return reduced, before, after
+
+
+def close_cpu_dependencies(target_details):
+    # Returns a copy of target_details where each CPU's feature list is the full transitive
+    # closure of its features, in feature index order. Feature dependency lists are unchanged.
+    closures = feature_closures(target_details)
+
+    closed = TargetDetails()
+    for feature in range(target_details.feature_count):
+        closed.add_feature(
+            target_details.feature_def_names[feature],
+            target_details.feature_llvm_names[feature],
+            target_details.feature_descriptions[feature],
+            target_details.feature_dependencies[feature])
+
+    for cpu in range(target_details.cpu_count):
+        closure = closure_of(target_details.cpu_dependency_masks[cpu], closures)
+        closed.add_cpu(target_details.cpu_llvm_names[cpu], iter_set_bits(closure))
+
+    return closed
@@ -0,0 +1,75 @@
+/*===- TableGen'erated file -------------------------------------*- C++ -*-===*\
+|*                                                                            *|
+|* Subtarget Enumeration Source Fragment                                      *|
+|*                                                                            *|
+|* Automatically generated file, do not edit!                                 *|
+|*                                                                            *|
+\*===----------------------------------------------------------------------===*/
+
+
+#ifdef GET_SUBTARGETINFO_ENUM
+#undef GET_SUBTARGETINFO_ENUM
+
+namespace llvm {
+namespace Toy {
+enum {
+  Feature2X = 0,
+  Feature10X = 1,
+  FeatureA = 2,
+  FeatureB = 3,
+  FeatureHidden = 4,
+  FeatureV8_1a = 5,
+  FeatureV8_2a = 6,
+  FeatureV8_10a = 7,
+  ProcFamilyX = 8,
+  NumSubtargetFeatures = 9
+};
+} // end namespace Toy
+} // end namespace llvm
+
+#endif // GET_SUBTARGETINFO_ENUM
+
+
+#ifdef GET_SUBTARGETINFO_MC_DESC
+#undef GET_SUBTARGETINFO_MC_DESC
+
+namespace llvm {
+// Sorted (by key) array of values for CPU features.
+extern const llvm::SubtargetFeatureKV ToyFeatureKV[] = {
+  { "10x", "Enable 10x", Toy::Feature10X, { { { 0x1ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "2x", "Enable 2x", Toy::Feature2X, { { { 0x0ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "a", "Enable \"A\" instructions", Toy::FeatureA, { { { 0x0ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "b", "Enable B instructions {with braces}", Toy::FeatureB, { { { 0x4ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "family-x", "Family X processors", Toy::ProcFamilyX, { { { 0x90ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "v8.10a", "Support v8.10a instructions", Toy::FeatureV8_10a, { { { 0x48ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "v8.1a", "Support v8.1a instructions", Toy::FeatureV8_1a, { { { 0x4ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+  { "v8.2a", "Support v8.2a instructions", Toy::FeatureV8_2a, { { { 0x20ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } } },
+};
+
+#ifdef DBGFIELD
+#error  "<target>GenSubtargetInfo.inc requires a DBGFIELD macro"
+#endif
+#if (defined(NDEBUG) || defined(LLVM_DISABLE_ABI_BREAKING_CHECKS_ENFORCING)) && !defined(LLVM_ENABLE_DUMP)
+#define DBGFIELD(x)
+#else
+#define DBGFIELD(x) x,
+#endif
+
+// ===============================================================
+// Data tables for the new per-operand machine model.
+
+// {ProcResourceIdx, Cycles}
+extern const llvm::MCWriteProcResEntry ToyWriteProcResTable[] = {
+  { 0,  0}, // Invalid
+}; // ToyWriteProcResTable
+
+// Sorted (by key) array of values for CPU subtype.
+extern const llvm::SubtargetSubTypeKV ToySubTypeKV[] = {
+ { "cpu-big", { { { 0x102ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } }, { { { 0x8ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } }, &NoSchedModel },
+ { "cpu-generic", { { { 0x0ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } }, { { { 0x0ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } }, &NoSchedModel },
+ { "cpu-little", { { { 0x28ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } }, { { { 0x0ULL, 0x0ULL, 0x0ULL, 0x0ULL, } } }, &NoSchedModel },
+};
+
+} // end namespace llvm
+
+#endif // GET_SUBTARGETINFO_MC_DESC
@@ -21,21 +21,39 @@ THE SOFTWARE.
 """
 
 import argparse
+import concurrent.futures
+import copy
+import glob
+import hashlib
+import io
 import json
 import sys
 import os
+import re
 import subprocess
 import tempfile
-
-from parse_tablegen import parse_tablegen_file
+import threading
+import time
+
+from blacklist import Blacklist
+from compare_details import format_change_report
+from details_bin import details_to_bin
+from feature_graph import close_cpu_dependencies, reduce_details
+from parse_tablegen import CHUNK_SIZE, TablegenParser, TargetDetails, parse_tablegen_records, resolve_details
+from parse_tablegen_json import TablegenJsonParser
+from schedule import BuildHistory, TablegenLimiter, actual_critical_path, available_memory_kb, expected_critical_path, format_critical_path, longest_first
 from gen_zig import generate_zig_code
-
-# Suffix to use for tablegen output files.
-TABLEGEN_FILE_SUFFIX = "_tablegen.cpp"
+from instrument import Tracer, wait_process
+from output_manifest import OutputManifest, digest_bytes, source_digest, write_if_changed
+from tablegen_cache import TABLEGEN_FILE_SUFFIX, TABLEGEN_JSON_FILE_SUFFIX, TablegenCache, TablegenInputs, default_cache_dir, details_key, tblgen_identity
+from watch import Watcher
 
 # Suffix to use for definition JSON output files.
 DEF_FILE_SUFFIX = ".json"
 
+# Suffix to use for binary details output files.
+DETAILS_BIN_FILE_SUFFIX = ".bin"
+
 # Suffix to use for Zig output files.
 ZIG_FILE_SUFFIX = ".zig"
 
@@ -46,8 +64,8 @@ class Target:
         self.td_name = llvm_td_name
         self.output_name = zig_target_name
 
-        self.tablegen_file_name = zig_target_name + TABLEGEN_FILE_SUFFIX
         self.defs_file_name = zig_target_name + DEF_FILE_SUFFIX
+        self.details_bin_file_name = zig_target_name + DETAILS_BIN_FILE_SUFFIX
         self.zig_file_name = zig_target_name + ZIG_FILE_SUFFIX
 
 
@@ -74,6 +92,662 @@ TARGETS = [
 ]
 
 
+def load_blacklists(blacklist_path):
+    # Returns a dict mapping each target's LLVM target dir name to its Blacklist.
+    blacklists = {target.target_dir: Blacklist() for target in TARGETS}
+    unknown_arches = set()
+
+    if blacklist_path is not None: 
+        with open(blacklist_path, "r") as blacklist_file:
+            for line_number, line in enumerate(blacklist_file, 1):
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+
+                if line[0] == '#':
+                    continue
+
+                # Only the first dot separates the arch, as regex patterns may contain more.
+                arch, _, entry = line.partition(".")
+                if len(arch) == 0 or len(entry) == 0:
+                    print("[!] Invalid syntax in blacklist file on line {}!".format(line_number), file=sys.stderr)
+                    sys.exit(1)
+
+                blacklist = blacklists.get(arch)
+                if blacklist is None:
+                    if arch not in unknown_arches:
+                        print("[!] Ignoring blacklist entries for unknown arch '{}' (line {})".format(arch, line_number), file=sys.stderr)
+                        unknown_arches.add(arch)
+                    continue
+
+                try:
+                    blacklist.add(entry)
+                except re.error as e:
+                    print("[!] Invalid blacklist pattern '{}' on line {}: {}".format(entry, line_number, e), file=sys.stderr)
+                    sys.exit(1)
+
+    return blacklists
+
+
+def build_history(working_dir, tablegen_cache, label=None):
+    # Timings differ on every run, so the history is kept in the work dir, or else in the cache
+    # dir (per version label), rather than next to the outputs. Without either, none is kept.
+    if working_dir is not None:
+        return BuildHistory(working_dir)
+
+    if tablegen_cache is not None:
+        history_dir = os.path.join(tablegen_cache.cache_dir, "history")
+        if label is not None:
+            history_dir = os.path.join(history_dir, label)
+        os.makedirs(history_dir, exist_ok=True)
+        return BuildHistory(history_dir)
+
+    return BuildHistory(None)
+
+
+class Config:
+    # Settings shared by every target's pipeline, derived from the command line.
+    def __init__(self, args, tblgen_path, llvm_target_dir, output_dir, working_dir, tablegen_cache, blacklists):
+        self.tblgen_path = tblgen_path
+        self.label = None
+        self.llvm_target_dir = llvm_target_dir
+        self.output_dir = output_dir
+        self.working_dir = working_dir
+        self.tablegen_inputs = TablegenInputs(tblgen_identity(tblgen_path))
+        self.tablegen_cache = tablegen_cache
+        self.frontend = FRONTENDS[args.frontend]
+        self.tablegen_flags = TABLEGEN_FLAGS + [self.frontend.backend_flag]
+        self.output_details_json = args.output_details_json
+        self.output_details_bin = args.output_details_bin
+        self.reduce_dependencies = args.reduce_dependencies
+        self.packed_feature_sets = args.packed_feature_sets
+        self.shard_cpus = args.shard_cpus
+        self.intern_feature_sets = args.intern_feature_sets
+        self.cpu_closures = args.cpu_closures
+        self.blacklists = blacklists
+        self.force = args.force
+        self.manifest = OutputManifest(output_dir)
+        self.tracer = Tracer(enabled=args.trace is not None, profile_dir=args.profile)
+        self.history = build_history(working_dir, tablegen_cache)
+        self.tablegen_limiter = TablegenLimiter(memory_budget_kb=available_memory_kb())
+
+        # In watch mode, maps target output names to (tablegen key, features, cpus), so that
+        # parsed tablegen output survives between rebuilds.
+        self.records = {} if args.watch else None
+
+        # When set, every target is processed (rather than skipped if up to date) and its resolved
+        # details are kept in `details`, by target output name, for the change report.
+        self.keep_details = False
+        self.details = {}
+
+        # Changes to the generator itself must invalidate previously generated outputs, and
+        # changes to the parsers, resolver and blacklist matching must also invalidate cached details.
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.generator_digest = source_digest(glob.glob(os.path.join(script_dir, "*.py")))
+        self.resolver_digest = source_digest([os.path.join(script_dir, name) for name in ("parse_tablegen.py", "parse_tablegen_json.py", "blacklist.py")])
+
+    def for_version(self, label, tblgen_path, llvm_target_dir, output_dir, working_dir):
+        # Returns a copy of this config for one LLVM source tree of a multi-version run. Caches,
+        # the tracer and other settings are shared; the tablegen executable, directories and the
+        # manifest are per version.
+        config = copy.copy(self)
+        config.label = label
+        config.tblgen_path = tblgen_path
+        if tblgen_path != self.tblgen_path:
+            config.tablegen_inputs = TablegenInputs(tblgen_identity(tblgen_path))
+        else:
+            config.tablegen_inputs = TablegenInputs(self.tablegen_inputs.tblgen_identity)
+        config.llvm_target_dir = llvm_target_dir
+        config.output_dir = output_dir
+        config.working_dir = working_dir
+        config.manifest = OutputManifest(output_dir)
+        config.history = build_history(working_dir, self.tablegen_cache, label)
+        config.details = {}
+        return config
+
+    def target_name(self, target):
+        # Name of a target in progress messages and traces, qualified by version label if there is one.
+        if self.label is None:
+            return target.output_name
+        return "{}/{}".format(self.label, target.output_name)
+
+
+class SharedResults:
+    # Computes each keyed result only once per run, even when several threads ask for it at the
+    # same time: the first caller computes it, and the others wait for and reuse its result.
+    # Used to share work between LLVM versions whose targets have identical inputs.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, key, owner, compute):
+        # Returns (result, owner of the call that computed it).
+        with self._lock:
+            future = self._futures.get(key)
+            computing = future is None
+            if computing:
+                future = concurrent.futures.Future()
+                self._futures[key] = future
+
+        if computing:
+            try:
+                future.set_result((compute(), owner))
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+
+        return future.result()
+
+
+# Include directories passed to tablegen, relative to a target's directory.
+TABLEGEN_INCLUDE_DIRS = ["../../../include"]
+
+# Tablegen flags, excluding the executable, root .td file and backend flag.
+TABLEGEN_FLAGS = [arg for include_dir in TABLEGEN_INCLUDE_DIRS for arg in ("-I", include_dir)]
+
+
+class Frontend:
+    # A tablegen backend whose output can be parsed: its flag, the incremental parser for its
+    # output, and the suffix of its cached output files.
+    def __init__(self, backend_flag, parser_class, file_suffix):
+        self.backend_flag = backend_flag
+        self.parser_class = parser_class
+        self.file_suffix = file_suffix
+
+
+FRONTENDS = {
+    "subtarget": Frontend("--gen-subtarget", TablegenParser, TABLEGEN_FILE_SUFFIX),
+    "json": Frontend("--dump-json", TablegenJsonParser, TABLEGEN_JSON_FILE_SUFFIX),
+}
+
+
+def stream_tablegen(target, config, log, tee_file=None):
+    # Runs tablegen with its output piped straight into the frontend's parser, and returns the parser.
+    # If tee_file (a binary file) is given, the complete output is also written to it. Otherwise,
+    # tablegen is terminated as soon as the parser has everything it needs.
+    target_dir = os.path.join(config.llvm_target_dir, target.target_dir)
+    command = [config.tblgen_path, target.td_name] + config.tablegen_flags
+
+    parser = config.frontend.parser_class()
+    terminated = False
+
+    def on_wait():
+        log.append("  > Waiting for a free core or memory to run tablegen...")
+
+    log.append("  > Running tablegen...")
+
+    # stderr goes to a file rather than a pipe, so that a chatty tablegen cannot block on a full
+    # stderr pipe while we are reading stdout.
+    with config.tablegen_limiter.slot(config.history.tablegen_rss_kb(target.output_name), on_wait=on_wait), \
+            config.tracer.stage(config.target_name(target), "tablegen") as stats, \
+            tempfile.TemporaryFile(mode="w+") as stderr_file:
+        process = subprocess.Popen(command, cwd=target_dir, stdout=subprocess.PIPE, stderr=stderr_file)
+
+        bytes_read = 0
+        parse_seconds = 0.0
+
+        try:
+            while True:
+                chunk = process.stdout.read1(CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+
+                bytes_read += len(chunk)
+
+                if tee_file is not None:
+                    tee_file.write(chunk)
+
+                parse_start = time.perf_counter()
+                parser.feed(chunk)
+                parse_seconds += time.perf_counter() - parse_start
+
+                if parser.done and tee_file is None:
+                    process.terminate()
+                    terminated = True
+                    break
+        finally:
+            process.stdout.close()
+            returncode, tablegen_rss = wait_process(process)
+
+        stats["bytes_read"] = bytes_read
+        stats["parse_seconds"] = parse_seconds
+        stats["terminated_early"] = terminated
+        if tablegen_rss is not None:
+            stats["tablegen_max_rss_kb"] = tablegen_rss
+
+        if returncode != 0 and not terminated:
+            stderr_file.seek(0)
+            log.extend("    " + line for line in stderr_file.read().splitlines())
+            raise subprocess.CalledProcessError(returncode, command)
+
+    return parser
+
+
+def parse_cached_tablegen(target, config, tablegen_in, log):
+    log.append("  > Using cached tablegen output")
+    log.append("  > Parsing tablegen...")
+    with config.tracer.stage(config.target_name(target), "parse") as stats, tablegen_in:
+        stats["bytes"] = os.fstat(tablegen_in.fileno()).st_size
+        return parse_tablegen_records(tablegen_in, config.frontend.parser_class())
+
+
+def parse_tablegen_cached(target, config, key, log):
+    # Parses the target's tablegen output from the cache, or runs tablegen and stores its output
+    # in the cache if the target's inputs have not been seen before. Returns (features, cpus).
+    # If another run sharing the cache is already producing the same output, waits for it.
+    cache = config.tablegen_cache
+    suffix = config.frontend.file_suffix
+
+    tablegen_in = cache.open_entry(target.output_name, key, suffix)
+    if tablegen_in is not None:
+        return parse_cached_tablegen(target, config, tablegen_in, log)
+
+    def on_wait():
+        log.append("  > Waiting for another run to produce tablegen output...")
+
+    with cache.lock(cache.path(target.output_name, key, suffix), on_wait=on_wait):
+        # The run we waited for (if any) has published the entry by now.
+        tablegen_in = cache.open_entry(target.output_name, key, suffix)
+        if tablegen_in is not None:
+            return parse_cached_tablegen(target, config, tablegen_in, log)
+
+        tablegen_out, temp_path = cache.new_entry_file(target.output_name)
+        try:
+            with tablegen_out:
+                parser = stream_tablegen(target, config, log, tee_file=tablegen_out)
+        except:
+            os.remove(temp_path)
+            raise
+
+        cache.publish(temp_path, target.output_name, key, suffix)
+
+    return parser.finish()
+
+
+def target_inputs_digest(config, tablegen_key, blacklist):
+    # Digest of everything that determines a target's outputs.
+    hasher = hashlib.sha256()
+    hasher.update(tablegen_key.encode())
+    hasher.update(config.generator_digest.encode())
+    hasher.update("\n".join(sorted(blacklist)).encode())
+    hasher.update("\njson={}".format(config.output_details_json).encode())
+    hasher.update("\nbin={}".format(config.output_details_bin).encode())
+    hasher.update("\nreduce={}".format(config.reduce_dependencies).encode())
+    hasher.update("\npacked={}".format(config.packed_feature_sets).encode())
+    hasher.update("\nshard_cpus={}".format(config.shard_cpus).encode())
+    hasher.update("\nintern={}".format(config.intern_feature_sets).encode())
+    hasher.update("\ncpu_closures={}".format(config.cpu_closures).encode())
+
+    return hasher.hexdigest()
+
+
+def process_target(target, config, shared, log):
+    # Runs tablegen, parsing and Zig generation for a single target.
+    # Outputs are only rewritten if their contents change, and the whole target is skipped if
+    # its inputs are the same as when its outputs were last generated.
+    # Parsing, resolution and emission are shared through `shared` with other LLVM versions
+    # whose target has the same inputs or the same resolved details.
+    # Progress messages are appended to `log` so that output stays grouped per target
+    # even when several targets are processed at once.
+    # Returns the resolved TargetDetails, or None if the target was skipped.
+
+    target_dir = os.path.join(config.llvm_target_dir, target.target_dir)
+    blacklist = config.blacklists[target.target_dir]
+    name = config.target_name(target)
+
+    defs_file_paths = []
+    if config.working_dir is not None:
+        defs_file_paths.append(os.path.join(config.working_dir, target.defs_file_name))
+    if config.output_details_json:
+        defs_file_paths.append(os.path.join(config.output_dir, target.defs_file_name))
+
+    details_bin_file_path = None
+    if config.output_details_bin:
+        details_bin_file_path = os.path.join(config.output_dir, target.details_bin_file_name)
+
+    zig_file_path = os.path.join(config.output_dir, target.zig_file_name)
+
+    output_paths = defs_file_paths + [zig_file_path]
+    if details_bin_file_path is not None:
+        output_paths.append(details_bin_file_path)
+
+    tracer = config.tracer
+    tracer.reset_stages(name)
+
+    with tracer.stage(name, "inputs"):
+        tablegen_key = config.tablegen_inputs.key(target_dir, target.td_name, config.tablegen_flags, TABLEGEN_INCLUDE_DIRS)
+        inputs_digest = target_inputs_digest(config, tablegen_key, blacklist)
+
+        up_to_date = config.manifest.is_up_to_date(target.output_name, inputs_digest, output_paths)
+
+    if up_to_date and not config.force and not config.keep_details:
+        log.append("  > Up to date")
+        return None
+
+    def load_records():
+        records = None
+        if config.records is not None:
+            records = config.records.get(target.output_name)
+
+        if records is not None and records[0] == tablegen_key:
+            log.append("  > Using parsed tablegen output from memory")
+            _, features, cpus = records
+        elif config.tablegen_cache is not None:
+            features, cpus = parse_tablegen_cached(target, config, tablegen_key, log)
+        else:
+            features, cpus = stream_tablegen(target, config, log).finish()
+
+        if config.records is not None:
+            config.records[target.output_name] = (tablegen_key, features, cpus)
+
+        return features, cpus
+
+    def cached_details_key():
+        # Key of this target's details in the cache, if its tablegen output is cached.
+        output_digest = config.tablegen_cache.output_digest(target.output_name, tablegen_key, config.frontend.file_suffix)
+        if output_digest is None:
+            return None
+        return details_key(output_digest, blacklist, config.resolver_digest)
+
+    def resolve():
+        target_details = None
+
+        cache = config.tablegen_cache
+        if cache is not None:
+            key = cached_details_key()
+            details_data = cache.lookup_details(target.output_name, key) if key is not None else None
+
+            if details_data is not None:
+                log.append("  > Using cached details")
+                with tracer.stage(name, "load-details") as stats:
+                    stats["bytes"] = len(details_data)
+                    target_details = TargetDetails.from_json(json.loads(details_data))
+
+        if target_details is None:
+            # Versions whose tablegen output is known (cached) to be identical share one parse,
+            # even if their inputs differ; otherwise only identical inputs are known to match.
+            output_digest = None
+            if cache is not None:
+                output_digest = cache.output_digest(target.output_name, tablegen_key, config.frontend.file_suffix)
+
+            if output_digest is not None:
+                features, cpus = shared_step(("records", "output", output_digest), load_records, "tablegen output")
+            else:
+                features, cpus = shared_step(("records", tablegen_key), load_records, "tablegen inputs")
+
+            with tracer.stage(name, "resolve"):
+                target_details = resolve_details(features, cpus, blacklist)
+                details_data = json.dumps(target_details.to_json(), indent=4).encode()
+
+            if cache is not None:
+                key = cached_details_key()
+                if key is not None:
+                    cache.store_details(target.output_name, key, details_data)
+
+        details_bin_data = None
+        if details_bin_file_path is not None:
+            with tracer.stage(name, "encode"):
+                details_bin_data = details_to_bin(target_details)
+
+        return target_details, details_data, details_bin_data
+
+    def emit():
+        log.append("  > Generating Zig source...")
+        with tracer.stage(name, "emit") as stats:
+            emitted_details = target_details
+            if config.reduce_dependencies:
+                emitted_details, before, after = reduce_details(target_details)
+                log.append("  > Reduced dependency lists from {} to {} entries".format(before, after))
+            if config.cpu_closures:
+                emitted_details = close_cpu_dependencies(emitted_details)
+
+            def generate(intern_feature_sets):
+                # Returns the arch file, the CPU family files by path and the number of interned sets.
+                zig_out = io.StringIO()
+                cpu_files = {} if config.shard_cpus else None
+                interned = generate_zig_code(
+                    zig_out, target.output_name, emitted_details,
+                    packed_feature_sets=config.packed_feature_sets, cpu_files=cpu_files, intern_feature_sets=intern_feature_sets)
+                return zig_out.getvalue(), cpu_files, interned
+
+            zig_text, cpu_files, interned = generate(config.intern_feature_sets)
+            zig_data = zig_text.encode()
+            stats["bytes"] = len(zig_data)
+
+            if config.intern_feature_sets:
+                def total_size(zig_text, cpu_files):
+                    return len(zig_text.encode()) + sum(len(text.encode()) for text in (cpu_files or {}).values())
+
+                # Emitting again without interning costs far less than tablegen, and tells how much it saved.
+                plain_size = total_size(*generate(False)[:2])
+                interned_size = total_size(zig_text, cpu_files)
+                if interned_size == plain_size:
+                    log.append("  > Interned {} feature sets, Zig output unchanged at {} bytes".format(interned, plain_size))
+                else:
+                    log.append("  > Interned {} feature sets, Zig output {} from {} to {} bytes ({:+.1f}%)".format(
+                        interned, "grew" if interned_size > plain_size else "shrank", plain_size, interned_size,
+                        (interned_size - plain_size) * 100 / plain_size))
+
+            # CPU family files, by path relative to the output dir.
+            cpu_file_data = {}
+            if cpu_files is not None:
+                cpu_file_data = {path: text.encode() for path, text in cpu_files.items()}
+                stats["cpu_file_bytes"] = sum(len(data) for data in cpu_file_data.values())
+                log.append("  > Split CPUs into {} family files".format(len(cpu_file_data)))
+
+        return zig_data, cpu_file_data
+
+    reused_from = set()
+
+    def shared_step(key, compute, what):
+        result, owner = shared.get(key, name, compute)
+        if owner != name and owner not in reused_from:
+            log.append("  > Same {} as {}, reusing its results".format(what, owner))
+            reused_from.add(owner)
+        return result
+
+    target_details, details_data, details_bin_data = shared_step(("details", inputs_digest), resolve, "inputs")
+    zig_data, cpu_file_data = shared_step(("zig", target.output_name, digest_bytes(details_data)), emit, "resolved details")
+
+    outputs = {path: details_data for path in defs_file_paths}
+    outputs[zig_file_path] = zig_data
+    for path, data in cpu_file_data.items():
+        outputs[os.path.join(config.output_dir, *path.split("/"))] = data
+    if details_bin_file_path is not None:
+        outputs[details_bin_file_path] = details_bin_data
+
+    with tracer.stage(name, "write"):
+        if config.shard_cpus:
+            # Family files of CPU families that no longer exist would be left behind otherwise.
+            cpu_dir = os.path.join(config.output_dir, target.output_name)
+            os.makedirs(cpu_dir, exist_ok=True)
+            for path in glob.glob(os.path.join(cpu_dir, "cpu_*" + ZIG_FILE_SUFFIX)):
+                if path not in outputs:
+                    os.remove(path)
+                    log.append("  > Removed {}".format(path))
+
+        for path, data in outputs.items():
+            if write_if_changed(path, data):
+                log.append("  > Wrote {}".format(path))
+
+    config.manifest.update(
+        target.output_name,
+        inputs_digest,
+        digest_bytes(details_data),
+        {path: digest_bytes(data) for path, data in outputs.items()})
+
+    if tracer.enabled:
+        durations = tracer.stage_durations(name)
+        log.append("  > Timings: " + ", ".join("{} {:.3f}s".format(stage, seconds) for stage, seconds in durations.items()))
+
+    return target_details
+
+
+def run_target(target, config, shared):
+    # Wraps process_target so that a failing target does not take the others down with it.
+    # Returns the target's progress lines, its resolved details (or None) and an error message,
+    # or None on success.
+
+    log = []
+
+    try:
+        target_details = process_target(target, config, shared, log)
+    except subprocess.CalledProcessError as e:
+        return log, None, "tablegen exited with status {}".format(e.returncode)
+    except SystemExit as e:
+        return log, None, "internal error (exit status {})".format(e.code)
+    except Exception as e:
+        return log, None, "{}: {}".format(type(e).__name__, e)
+
+    return log, target_details, None
+
+
+def run_targets(targets, configs, jobs):
+    # Processes the given targets for each config (one per LLVM version), returning the names of
+    # those that failed.
+
+    # Targets run on worker threads: tablegen itself is a subprocess, so one target's parsing and
+    # generation overlaps with other targets' tablegen runs. They start longest first by their
+    # history, but results are reported in order.
+    shared = SharedResults()
+    work = [(target, config) for config in configs for target in targets]
+
+    def estimate(item):
+        target, config = item
+        return config.history.estimate(target.output_name)
+
+    scheduled = longest_first(work, estimate)
+    expected = [(config.target_name(target), seconds) for (target, config), seconds in zip(scheduled, map(estimate, scheduled)) if seconds is not None]
+    runs = []
+
+    def timed_run_target(target, config):
+        start = time.perf_counter()
+        result = run_target(target, config, shared)
+        runs.append((config.target_name(target), start, time.perf_counter(), threading.get_ident()))
+        return result
+
+    failed_targets = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {item: executor.submit(timed_run_target, *item) for item in scheduled}
+
+        for target, config in work:
+            log, target_details, error = futures[(target, config)].result()
+            name = config.target_name(target)
+
+            print("= {}".format(name))
+            for line in log:
+                print(line)
+
+            if error is not None:
+                print("[!] {}: {}".format(name, error), file=sys.stderr)
+                failed_targets.append(name)
+            else:
+                if config.keep_details:
+                    config.details[target.output_name] = target_details
+
+                # Targets skipped as up to date keep the durations of the run that processed them.
+                if target_details is not None:
+                    config.history.record(
+                        target.output_name,
+                        config.tracer.stage_durations(name),
+                        config.tracer.stage_values(name, "tablegen").get("tablegen_max_rss_kb"))
+
+            sys.stdout.flush()
+
+    for config in configs:
+        config.manifest.save()
+        config.history.save()
+
+    if jobs > 1 and len(work) > 1:
+        if len(expected) == len(work):
+            # Tablegen dominates, so at most as many targets as may run tablegen make progress at once.
+            workers = min(jobs, configs[0].tablegen_limiter.max_processes)
+            expected_path = format_critical_path(*expected_critical_path(expected, workers))
+        else:
+            expected_path = "unknown, {} of {} targets have no history".format(len(work) - len(expected), len(work))
+        print("= Critical path: expected {}, actual {}".format(expected_path, format_critical_path(*actual_critical_path(runs))))
+
+    return failed_targets
+
+
+def version_labels(llvm_source_dirs):
+    # Names the output subdirectory of each LLVM source dir after the dir itself, disambiguating
+    # dirs that share a name.
+    labels = []
+    for source_dir in llvm_source_dirs:
+        base_label = os.path.basename(os.path.normpath(source_dir)) or "llvm"
+        label = base_label
+        suffix = 2
+        while label in labels:
+            label = "{}-{}".format(base_label, suffix)
+            suffix += 1
+        labels.append(label)
+
+    return labels
+
+
+def write_change_report(configs, path):
+    # Writes the changes to each target's details between consecutive LLVM versions.
+    arch_versions = {
+        target.output_name: [(config.label, config.details.get(target.output_name)) for config in configs]
+        for target in TARGETS
+    }
+
+    lines = format_change_report(arch_versions)
+    write_if_changed(path, "".join(line + "\n" for line in lines).encode())
+
+
+# Watcher owner of the blacklist file, whose changes affect every target.
+BLACKLIST_OWNER = "<blacklist>"
+
+
+def watch_targets(config, jobs, blacklist_path):
+    # Regenerates targets whenever their .td files change, until interrupted.
+    # Each target's directory and the .td files it transitively includes are watched. Parsed
+    # tablegen output is kept in memory, so a blacklist change only re-resolves and re-emits.
+    watcher = Watcher()
+
+    def watch_target(target):
+        target_dir = os.path.join(config.llvm_target_dir, target.target_dir)
+        td_paths = config.tablegen_inputs.td_paths(target_dir, target.td_name, TABLEGEN_INCLUDE_DIRS)
+        watcher.set_paths(target.output_name, [target_dir] + td_paths)
+
+    for target in TARGETS:
+        watch_target(target)
+
+    if blacklist_path is not None:
+        watcher.set_paths(BLACKLIST_OWNER, [blacklist_path])
+
+    print("= Watching for changes (Ctrl-C to stop)...")
+    sys.stdout.flush()
+
+    try:
+        while True:
+            changed_paths = watcher.wait_for_changes()
+            config.tablegen_inputs.forget(changed_paths)
+
+            owners = watcher.owners(changed_paths)
+
+            if BLACKLIST_OWNER in owners:
+                try:
+                    config.blacklists = load_blacklists(blacklist_path)
+                except SystemExit:
+                    print("[!] Keeping previous blacklist.", file=sys.stderr)
+                targets = TARGETS
+            else:
+                targets = [target for target in TARGETS if target.output_name in owners]
+
+            print("= Changed: {}".format(", ".join(sorted(changed_paths))))
+            run_targets(targets, [config], jobs)
+
+            # Includes may have been added or removed.
+            for target in targets:
+                watch_target(target)
+    except KeyboardInterrupt:
+        pass
+
+
 def main():
     arg_parser = argparse.ArgumentParser(
         description="Generate Zig standard library representation of LLVM target feature/CPU information.", 
@@ -81,12 +755,19 @@ def main():
 
     arg_parser.add_argument(
         "llvm_source_dir", 
-        help="path to LLVM top-level source directory")
+        nargs="+",
+        help="path to LLVM top-level source directory; if several are given, each version's outputs go to a subdirectory of the output dir named after its source dir")
 
     arg_parser.add_argument(
         "-tblgen-exe", 
-        default="llvm-tblgen", 
-        help="(default: llvm-tblgen) override tablegen executable path")
+        action="append",
+        default=None,
+        help="(default: llvm-tblgen) override tablegen executable path; with several LLVM source dirs, give it once for all of them or once per source dir, in the same order")
+    arg_parser.add_argument(
+        "-frontend",
+        choices=sorted(FRONTENDS),
+        default="subtarget",
+        help="(default: subtarget) tablegen output to read target details from: the --gen-subtarget C++ tables, or the --dump-json record dump")
     arg_parser.add_argument(
         "-output-dir", 
         default="out", 
@@ -94,92 +775,158 @@ def main():
     arg_parser.add_argument(
         "-work-dir", 
         default=None, 
-        help="(default: <temporary dir>) override directory where intermediate results are stored")
+        help="(default: <none>) directory where intermediate results are stored")
     arg_parser.add_argument(
         "-cache-tablegen",
         action="store_true",
-        help="(default: false) cache tablegen results, or use cached results if they exist. Can only be used in combination with -work-dir")
+        help="(default: false) cache tablegen results keyed on the .td inputs and tablegen version, or use cached results if they exist")
+    arg_parser.add_argument(
+        "-cache-dir",
+        default=None,
+        help="(default: <work dir> if given, otherwise a per-user cache dir) override directory where cached results are stored")
+    arg_parser.add_argument(
+        "-cache-max-size",
+        type=int,
+        default=0,
+        help="(default: 0, unlimited) after generating, evict least recently used cache entries until the cache dir holds at most this many MB")
     arg_parser.add_argument(
         "-output-details-json",
         action="store_true",
         help="(default: false) output JSON representation of target details for all arches")
+    arg_parser.add_argument(
+        "-output-details-bin",
+        action="store_true",
+        help="(default: false) output a compact binary representation of target details for all arches, readable with details_bin.DetailsFile")
+    arg_parser.add_argument(
+        "-reduce-dependencies",
+        action="store_true",
+        help="(default: false) emit only the dependencies of each feature and CPU that are not already implied by its other dependencies")
+    arg_parser.add_argument(
+        "-packed-feature-sets",
+        action="store_true",
+        help="(default: false) emit feature sets as precomputed bit words instead of featureSet() calls listing each feature")
+    arg_parser.add_argument(
+        "-cpu-closures",
+        action="store_true",
+        help="(default: false) emit each CPU's full transitive closure of features, so that its dependencies need not be populated")
+    arg_parser.add_argument(
+        "-shard-cpus",
+        action="store_true",
+        help="(default: false) write each arch's CPUs to <arch>/cpu_<family>.zig files re-exported by <arch>.zig, so that builds referencing a few CPUs analyze less code")
+    arg_parser.add_argument(
+        "-intern-feature-sets",
+        action="store_true",
+        help="(default: false) emit each feature set that several features or CPUs share once, as a named constant they refer to")
     arg_parser.add_argument(
         "-blacklist",
         default=None,
-        help="(default: <none>) specify a file which contains <arch_name>.<feature_def_name> feature blacklist lines")
+        help="(default: <none>) specify a file which contains <arch_name>.<feature_def_name> feature blacklist lines, where the def name may also be a glob (e.g. ARMv8_*) or a re:<regex>")
+    arg_parser.add_argument(
+        "-j",
+        type=int,
+        default=1,
+        dest="jobs",
+        help="(default: 1) number of targets to process concurrently, or 0 to use one per CPU core")
+
+    arg_parser.add_argument(
+        "-trace",
+        default=None,
+        help="(default: <none>) write per-target stage timings, byte counts and peak memory usage to this file, in Chrome trace format")
+    arg_parser.add_argument(
+        "-profile",
+        default=None,
+        help="(default: <none>) run each stage under cProfile and write the stats to <target>.<stage>.prof files in this directory")
+    arg_parser.add_argument(
+        "-watch",
+        action="store_true",
+        help="(default: false) after generating, keep running and regenerate targets whose .td files (or the blacklist) change")
+    arg_parser.add_argument(
+        "-change-report",
+        default=None,
+        help="(default: <output dir>/changes.txt) with several LLVM source dirs, write the features and CPUs added, removed or changed between consecutive versions to this file")
+    arg_parser.add_argument(
+        "-force",
+        action="store_true",
+        help="(default: false) regenerate all targets, even those whose inputs are unchanged")
 
     args = arg_parser.parse_args()
 
-    llvm_source_root = args.llvm_source_dir
-    llvm_target_dir = os.path.join(llvm_source_root, "lib/Target")
+    llvm_source_dirs = args.llvm_source_dir
+
+    if args.watch and len(llvm_source_dirs) > 1:
+        print("[!] -watch supports only a single LLVM source dir!", file=sys.stderr)
+        sys.exit(1)
+
+    # Tablegen only reliably reads the .td files of its own LLVM release, so each source dir
+    # may have its own.
+    tblgen_paths = args.tblgen_exe or ["llvm-tblgen"]
+    if len(tblgen_paths) == 1:
+        tblgen_paths = tblgen_paths * len(llvm_source_dirs)
+    elif len(tblgen_paths) != len(llvm_source_dirs):
+        print("[!] Expected one -tblgen-exe, or one per LLVM source dir ({}), but got {}!".format(len(llvm_source_dirs), len(tblgen_paths)), file=sys.stderr)
+        sys.exit(1)
 
     output_dir = args.output_dir
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
 
-    tblgen_path = args.tblgen_exe
-
     if not os.path.isdir(output_dir):
         print("[!] Output dir must exist!", file=sys.stderr)
         sys.exit(1)
 
-    working_dir = args.work_dir or tempfile.mkdtemp(prefix="zig_gen_llvm_target_details")
-    if not os.path.exists(working_dir):
+    working_dir = args.work_dir
+    if working_dir is not None and not os.path.exists(working_dir):
         os.mkdir(working_dir)
 
-    # Only enable caching if a work dir is specified and caching is requested.
-    tablegen_cache_enabled = args.work_dir is not None and args.cache_tablegen
+    tablegen_cache = None
+    if args.cache_tablegen:
+        tablegen_cache = TablegenCache(args.cache_dir or args.work_dir or default_cache_dir())
 
-    blacklists = {target.target_dir: [] for target in TARGETS}
-    if args.blacklist is not None: 
-        with open(args.blacklist, "r") as blacklist_file:
-            for line in blacklist_file.readlines():
-                line = line.strip()
-                if len(line) == 0:
-                    continue
+    blacklists = load_blacklists(args.blacklist)
 
-                if line[0] == '#':
-                    continue
+    config = Config(args, tblgen_paths[0], os.path.join(llvm_source_dirs[0], "lib/Target"), output_dir, working_dir, tablegen_cache, blacklists)
 
-                split = line.split(".")
-                if len(split) != 2:
-                    print("[!] Invalid syntax in blacklist file!")
-                    sys.exit(1)
-                
-                blacklists[split[0]].append(split[1])   
+    configs = [config]
+    if len(llvm_source_dirs) > 1:
+        # Every version's details are needed for the change report, so none are skipped.
+        config.keep_details = True
 
-    for target in TARGETS:
-        print("= {}".format(target.output_name))
+        configs = []
+        for label, tblgen_path, llvm_source_root in zip(version_labels(llvm_source_dirs), tblgen_paths, llvm_source_dirs):
+            version_output_dir = os.path.join(output_dir, label)
+            os.makedirs(version_output_dir, exist_ok=True)
+
+            version_working_dir = None
+            if working_dir is not None:
+                version_working_dir = os.path.join(working_dir, label)
+                os.makedirs(version_working_dir, exist_ok=True)
 
-        tablegen_file_path = os.path.join(working_dir, target.tablegen_file_name)
-        defs_file_path = os.path.join(working_dir, target.defs_file_name)
-        zig_file_path = os.path.join(output_dir, target.zig_file_name)
+            configs.append(config.for_version(label, tblgen_path, os.path.join(llvm_source_root, "lib/Target"), version_output_dir, version_working_dir))
 
-        if not tablegen_cache_enabled or not os.path.isfile(tablegen_file_path):
-            with open(tablegen_file_path, "w") as tablegen_out:
-                target_dir = os.path.join(llvm_target_dir, target.target_dir)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
 
-                print("  > Running tablegen...")
-                subprocess.run(
-                    [tblgen_path, target.td_name, "-I", "../../../include", "--gen-subtarget"],
-                    cwd=target_dir,
-                    stdout=tablegen_out
-                ).check_returncode()
+    failed_targets = run_targets(TARGETS, configs, jobs)
 
-        with open(tablegen_file_path, "r") as tablegen_in:
-            print("  > Parsing tablegen...")
-            target_details = parse_tablegen_file(tablegen_in, blacklists[target.target_dir])
+    if tablegen_cache is not None and args.cache_max_size > 0:
+        removed, freed = tablegen_cache.evict(args.cache_max_size * 1024 * 1024)
+        if removed > 0:
+            print("= Evicted {} cache entries ({:.1f} MB)".format(removed, freed / (1024 * 1024)))
 
-            with open(defs_file_path, "w") as defs_out:
-                json.dump(target_details, defs_out, indent=4)
+    if len(configs) > 1:
+        report_path = args.change_report or os.path.join(output_dir, "changes.txt")
+        write_change_report(configs, report_path)
+        print("= Change report: {}".format(report_path))
 
-            if args.output_details_json:
-                with open(os.path.join(output_dir, target.defs_file_name), "w") as defs_out:
-                    json.dump(target_details, defs_out, indent=4)
+    if args.trace is not None:
+        config.tracer.write_trace(args.trace)
 
-            with open(zig_file_path, "w") as zig_out:
-                print("  > Generating Zig source...")
-                generate_zig_code(zig_out, target.output_name, target_details)
+    if args.watch:
+        watch_targets(config, jobs, args.blacklist)
+        return
+
+    if len(failed_targets) > 0:
+        print("[!] Failed targets: {}".format(", ".join(failed_targets)), file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
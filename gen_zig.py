@@ -24,7 +24,7 @@ import re
 
 zig_ident_re = re.compile("^[a-zA-Z_][a-zA-Z0-9_]*$")
 int_re = re.compile("[iu][0-9]+")
-zig_kws = ["break", "goto", "else"]
+zig_kws = frozenset(["break", "goto", "else"])
 
 def zig_ident_escape(name):
     if zig_ident_re.match(name) is None:
@@ -41,109 +41,276 @@ def llvm_to_zig_name(name):
         name = '_' + name
     return name
 
-def generate_zig_code(out_file, arch_name, target_details):
-    out_file.write('const std = @import("../std.zig");\n')
-    out_file.write("const Cpu = std.Target.Cpu;\n")
-    out_file.write("\n")
-    out_file.write("pub const Feature = enum {\n")
-    
-    features = target_details["features"]
-    features.sort(key=lambda f: f["llvm_name"])
+# `lead` is what precedes the feature set expression (e.g. ".features = ") and `end` what follows it.
+def emit_feature_set(out, lead, deps, tag_names, indent="        ", end=","):
+    if len(deps) > 0:
+        out.append(f"{indent}{lead}featureSet(&[_]Feature{{\n")
+
+        for dep in deps:
+            out.append(f"{indent}    .{tag_names[dep]},\n")
+
+        out.append(f"{indent}}}){end}\n")
+    else:
+        out.append(f"{indent}{lead}featureSet(&[_]Feature{{}}){end}\n")
+
+def emit_packed_feature_set(out, lead, deps, enum_bits, word_count, indent="        ", end=","):
+    mask = 0
+    for dep in deps:
+        mask |= 1 << enum_bits[dep]
+
+    words = ", ".join(f"0x{(mask >> (64 * i)) & 0xffffffffffffffff:016x}" for i in range(word_count))
+    out.append(f"{indent}{lead}packedFeatureSet(&[_]u64{{ {words} }}){end}\n")
+
+cpu_family_re = re.compile("[a-z]*")
+
+# Families with fewer CPUs than this share a single "other" file.
+MIN_CPU_FAMILY_SIZE = 2
+
+def cpu_families(zig_names):
+    # Groups CPUs by family, taken to be the leading letters of their names (e.g. "cortex" for
+    # cortex_a53, "znver" for znver2). Returns the family name of each CPU.
+    families = [cpu_family_re.match(zig_name.lower()).group() or "other" for zig_name in zig_names]
+
+    sizes = {}
+    for family in families:
+        sizes[family] = sizes.get(family, 0) + 1
+
+    return [family if sizes[family] >= MIN_CPU_FAMILY_SIZE else "other" for family in families]
+
+# Builds a Cpu.Feature.Set from 64-bit words of feature bits in `Feature` order. Set stores
+# usize words, so the words are split up when usize is smaller.
+packed_feature_set_fn = """\
+fn packedFeatureSet(comptime words: []const u64) Cpu.Feature.Set {
+    const usize_bits = @bitSizeOf(usize);
+    const parts = 64 / usize_bits;
+    var result = Cpu.Feature.Set.empty;
+    for (words) |word, i| {
+        var j: usize = 0;
+        while (j < parts) : (j += 1) {
+            const part = @truncate(usize, word >> @intCast(u6, j * usize_bits));
+            if (i * parts + j < result.ints.len) {
+                result.ints[i * parts + j] = part;
+            } else {
+                std.debug.assert(part == 0);
+            }
+        }
+    }
+    return result;
+}
 
-    features_by_def_name = {feature["def_name"]: feature for feature in features}
+"""
+
+def generate_zig_code(out_file, arch_name, target_details, packed_feature_sets=False, cpu_files=None, intern_feature_sets=False):
+    # target_details is a parse_tablegen.TargetDetails, and is not modified.
+    # The whole file is built in memory as a list of strings and written with a single call.
+    # If packed_feature_sets is set, feature sets are emitted as precomputed bit words rather
+    # than featureSet() calls listing each feature.
+    # If cpu_files is a dict, CPU definitions are instead written to one file per CPU family,
+    # stored in cpu_files by path relative to the arch file (`<arch>/cpu_<family>.zig`), and
+    # re-exported from the arch file's `cpu` struct. Zig only analyzes the family files of
+    # the CPUs a build references.
+    # If intern_feature_sets is set, a feature set that more than one feature or CPU has is
+    # emitted once, as a `feature_set_<n>` constant, and referenced by name, wherever that is
+    # shorter than repeating it (counting the imports family files need to refer to it).
+    # Returns the number of interned feature sets.
+
+    llvm_names = target_details.feature_llvm_names
+    features = sorted(range(target_details.feature_count), key=llvm_names.__getitem__)
+
+    cpu_llvm_names = target_details.cpu_llvm_names
+    cpus = sorted(range(target_details.cpu_count), key=cpu_llvm_names.__getitem__)
+
+    # Enum tag names, by feature index.
+    tag_names = [zig_ident_escape(llvm_to_zig_name(llvm_name)) for llvm_name in llvm_names]
+
+    # Enum values (bit positions in a feature set), by feature index.
+    enum_bits = [0] * target_details.feature_count
+    for enum_value, feature in enumerate(features):
+        enum_bits[feature] = enum_value
+
+    word_count = max(1, (target_details.feature_count + 63) // 64)
+
+    def emit_set(out, lead, deps, indent, end):
+        if packed_feature_sets:
+            emit_packed_feature_set(out, lead, deps, enum_bits, word_count, indent, end)
+        else:
+            emit_feature_set(out, lead, deps, tag_names, indent, end)
+
+    cpu_zig_names = [llvm_to_zig_name(cpu_llvm_names[cpu]) for cpu in cpus]
+    cpu_ident_names = [zig_ident_escape(zig_name) for zig_name in cpu_zig_names]
+
+    # Family file of each CPU, by path relative to the arch file, if CPUs are split up.
+    cpu_paths = [None] * len(cpus)
+    cpu_indent = "        "
+    if cpu_files is not None:
+        cpu_paths = [f"{arch_name}/cpu_{family}.zig" for family in cpu_families(cpu_zig_names)]
+        cpu_indent = "    "
+
+    # Family files refer to the arch file's interned constants.
+    visibility = "pub " if cpu_files is not None else ""
+
+    def import_line(name):
+        return f'const {name} = @import("../{arch_name}.zig").{name};\n'
+
+    # Interned feature sets: set (as a mask of feature indices) -> constant name, plus the
+    # dependency list the constant is emitted from.
+    interned_names = {}
+    interned_deps = []
+
+    if intern_feature_sets:
+        # Every use of a set, as (dependency list, field name, indent, family file path).
+        uses_by_mask = {}
+        for feature in features:
+            deps = target_details.feature_dependencies[feature]
+            uses_by_mask.setdefault(target_details.feature_dependency_masks[feature], []).append((deps, "dependencies", "        ", None))
+        for cpu, path in zip(cpus, cpu_paths):
+            deps = target_details.cpu_dependencies[cpu]
+            uses_by_mask.setdefault(target_details.cpu_dependency_masks[cpu], []).append((deps, "features", cpu_indent, path))
+
+        def set_size(lead, deps, indent, end):
+            lines = []
+            emit_set(lines, lead, deps, indent, end)
+            return sum(len(line) for line in lines)
+
+        for mask, uses in uses_by_mask.items():
+            if len(uses) < 2:
+                continue
+
+            name = f"feature_set_{len(interned_deps)}"
+            deps = uses[0][0]
 
-    cpus = target_details["cpus"]
-    cpus.sort(key=lambda c: c["llvm_name"])
+            repeated_size = sum(set_size(f".{field_name} = ", deps, indent, ",") for _, field_name, indent, _ in uses)
+
+            interned_size = set_size(f"{visibility}const {name} = ", deps, "", ";")
+            interned_size += sum(len(f"{indent}.{field_name} = {name},\n") for _, field_name, indent, _ in uses)
+            interned_size += sum(len(import_line(name)) for path in {path for _, _, _, path in uses if path is not None})
+
+            if interned_size < repeated_size:
+                interned_names[mask] = name
+                interned_deps.append(deps)
+
+    # Interned sets a family file refers to, by path, in order of first use.
+    family_interned_names = {}
+
+    def emit_dependencies(out, field_name, deps, mask, indent="        ", path=None):
+        name = interned_names.get(mask) if intern_feature_sets else None
+        if name is None:
+            emit_set(out, f".{field_name} = ", deps, indent, ",")
+            return
+
+        out.append(f"{indent}.{field_name} = {name},\n")
+        if path is not None:
+            family_interned_names.setdefault(path, {})[name] = None
+
+    out = []
+
+    out.append('const std = @import("../std.zig");\n')
+    out.append("const Cpu = std.Target.Cpu;\n")
+    out.append("\n")
+    out.append("pub const Feature = enum {\n")
 
     for feature in features:
-        tag_name = zig_ident_escape(llvm_to_zig_name(feature["llvm_name"]))
+        out.append(f"    {tag_names[feature]},\n")
+
+    out.append("};\n")
+    out.append("\n")
 
-        out_file.write(f"    {tag_name},\n")
+    out.append("pub usingnamespace Cpu.Feature.feature_set_fns(Feature);\n")
+    out.append("\n")
 
-    out_file.write("};\n")
-    out_file.write("\n")
+    if packed_feature_sets:
+        # Family files build their feature sets with the arch file's function.
+        out.append(("pub " if cpu_files is not None else "") + packed_feature_set_fn)
 
-    out_file.write("pub usingnamespace Cpu.Feature.feature_set_fns(Feature);\n")
-    out_file.write("\n")
+    if len(interned_deps) > 0:
+        for mask, deps in zip(interned_names, interned_deps):
+            emit_set(out, f"{visibility}const {interned_names[mask]} = ", deps, "", ";")
+        out.append("\n")
 
-    out_file.write("pub const all_features = blk: {\n")
-    out_file.write("    const len = @typeInfo(Feature).Enum.fields.len;\n")
-    out_file.write("    std.debug.assert(len <= Cpu.Feature.Set.bit_count);\n")
-    out_file.write("    var result: [len]Cpu.Feature = undefined;\n");
+    out.append("pub const all_features = blk: {\n")
+    out.append("    const len = @typeInfo(Feature).Enum.fields.len;\n")
+    out.append("    std.debug.assert(len <= Cpu.Feature.Set.bit_count);\n")
+    out.append("    var result: [len]Cpu.Feature = undefined;\n")
 
     for feature in features:
-        llvm_name = feature["llvm_name"]
-        zig_name = llvm_to_zig_name(llvm_name)
-        tag_name = zig_ident_escape(zig_name)
-        description = feature["description"]
-        deps = feature["dependencies"]
+        llvm_name = llvm_names[feature]
+        tag_name = tag_names[feature]
+        description = target_details.feature_descriptions[feature]
 
-        out_file.write(f"    result[@enumToInt(Feature.{tag_name})] = .{{\n")
-        out_file.write(f"        .index = @enumToInt(Feature.{tag_name}),\n")
-        out_file.write(f"        .name = @tagName(Feature.{tag_name}),\n")
-        out_file.write(f'        .llvm_name = "{llvm_name}",\n')
-        out_file.write(f'        .description = "{description}",\n')
+        out.append(f"    result[@enumToInt(Feature.{tag_name})] = .{{\n")
+        out.append(f"        .index = @enumToInt(Feature.{tag_name}),\n")
+        out.append(f"        .name = @tagName(Feature.{tag_name}),\n")
+        out.append(f'        .llvm_name = "{llvm_name}",\n')
+        out.append(f'        .description = "{description}",\n')
 
-        if len(deps) > 0: 
-            out_file.write("        .dependencies = featureSet(&[_]Feature{\n")
+        emit_dependencies(
+            out, "dependencies", target_details.feature_dependencies[feature], target_details.feature_dependency_masks[feature])
 
-            for dep in deps:
-                dep_feature = features_by_def_name[dep]
-                dep_tag_name = zig_ident_escape(llvm_to_zig_name(dep_feature["llvm_name"]))
+        out.append("    };\n")
 
-                indent = " " * 12
-                out_file.write(f"{indent}.{dep_tag_name},\n")
+    out.append("    break :blk result;\n")
+    out.append("};\n")
+    out.append("\n")
 
-            out_file.write("        }),\n")
-        else:
-            out_file.write("        .dependencies = featureSet(&[_]Feature{}),\n")
+    out.append("pub const cpu = struct {\n")
 
-        out_file.write("    };\n")
+    if cpu_files is None:
+        for cpu, zig_name, ident_name in zip(cpus, cpu_zig_names, cpu_ident_names):
+            out.append(f"    pub const {ident_name} = Cpu{{\n")
+            out.append(f'        .name = "{zig_name}",\n')
+            out.append(f'        .llvm_name = "{cpu_llvm_names[cpu]}",\n')
 
-    out_file.write("    break :blk result;\n")
-    out_file.write("};\n")
-    out_file.write("\n")
+            emit_dependencies(out, "features", target_details.cpu_dependencies[cpu], target_details.cpu_dependency_masks[cpu])
 
-    out_file.write("pub const cpu = struct {\n")
+            out.append("    };\n")
+    else:
+        family_outs = {}
 
-    for cpu in cpus:
-        llvm_name = cpu["llvm_name"]
-        zig_name = llvm_to_zig_name(llvm_name)
-        ident_name = zig_ident_escape(zig_name)
-        deps = cpu["dependencies"]
+        for cpu, zig_name, ident_name, path in zip(cpus, cpu_zig_names, cpu_ident_names, cpu_paths):
+            family_out = family_outs.setdefault(path, [])
 
-        out_file.write(f"    pub const {ident_name} = Cpu{{\n")
-        out_file.write(f'        .name = "{zig_name}",\n')
-        out_file.write(f'        .llvm_name = "{llvm_name}",\n')
+            family_out.append("\n")
+            family_out.append(f"pub const {ident_name} = Cpu{{\n")
+            family_out.append(f'    .name = "{zig_name}",\n')
+            family_out.append(f'    .llvm_name = "{cpu_llvm_names[cpu]}",\n')
 
-        if len(deps) > 0: 
-            out_file.write("        .features = featureSet(&[_]Feature{\n")
+            emit_dependencies(
+                family_out, "features", target_details.cpu_dependencies[cpu], target_details.cpu_dependency_masks[cpu],
+                cpu_indent, path)
 
-            for dep in deps:
-                dep_feature = features_by_def_name[dep]
-                dep_tag_name = zig_ident_escape(llvm_to_zig_name(dep_feature["llvm_name"]))
+            family_out.append("};\n")
 
-                indent = " " * 12
-                out_file.write(f"{indent}.{dep_tag_name},\n")
+            out.append(f'    pub const {ident_name} = @import("{path}").{ident_name};\n')
 
-            out_file.write("        }),\n")
-        else:
-            out_file.write("        .features = featureSet(&[_]Feature{}),\n")
+        for path, family_out in family_outs.items():
+            header = []
+            header.append('const std = @import("../../std.zig");\n')
+            header.append("const Cpu = std.Target.Cpu;\n")
+            if packed_feature_sets:
+                header.append(f'const packedFeatureSet = @import("../{arch_name}.zig").packedFeatureSet;\n')
+            else:
+                header.append(f'const Feature = @import("../{arch_name}.zig").Feature;\n')
+                header.append(f'const featureSet = @import("../{arch_name}.zig").featureSet;\n')
+
+            for name in family_interned_names.get(path, {}):
+                header.append(import_line(name))
 
-        out_file.write("    };\n")
+            cpu_files[path] = "".join(header + family_out)
 
-    out_file.write("};\n")
-    out_file.write("\n")
+    out.append("};\n")
+    out.append("\n")
 
-    out_file.write(f"/// All {arch_name} CPUs, sorted alphabetically by name.\n")
-    out_file.write( 
+    out.append(f"/// All {arch_name} CPUs, sorted alphabetically by name.\n")
+    out.append(
         "/// TODO: Replace this with usage of `std.meta.declList`. It does work, but stage1\n"
         "/// compiler has inefficient memory and CPU usage, affecting build times.\n")
-    out_file.write("pub const all_cpus = &[_]*const Cpu{\n")
+    out.append("pub const all_cpus = &[_]*const Cpu{\n")
+
+    for ident_name in cpu_ident_names:
+        out.append(f"    &cpu.{ident_name},\n")
 
-    for cpu in cpus:
-        name = zig_ident_escape(llvm_to_zig_name(cpu["llvm_name"]))
+    out.append("};\n")
 
-        out_file.write(f"    &cpu.{name},\n")
+    out_file.write("".join(out))
 
-    out_file.write("};\n")
+    return len(interned_deps)
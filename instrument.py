@@ -0,0 +1,199 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+# resource is only available on Unix-like systems. Without it, memory usage is not reported.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Only one cProfile profiler can be active at a time (from Python 3.12, across all threads), so
+# profiled stages run one at a time.
+profile_lock = threading.Lock()
+
+
+def max_rss_kb(who="self"):
+    # Peak resident set size, in KB, of this process ("self") or of its waited-for children ("children").
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    if sys.platform == "darwin":
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+def wait_process(process):
+    # Waits for a subprocess.Popen process. Returns (return code, peak RSS of the process in KB),
+    # where the peak RSS is None if the platform cannot report it.
+    if not hasattr(os, "wait4") or process.returncode is not None:
+        return process.wait(), None
+
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped by Popen itself (e.g. terminate() polls the process first).
+        return process.wait(), None
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    rss = usage.ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+
+    return process.returncode, rss
+
+
+class Tracer:
+    # Records the duration of each stage of each target's pipeline, and optionally profiles them.
+    #
+    # Stages are recorded as Chrome trace events (viewable in chrome://tracing or Perfetto),
+    # with one row per target. Callers can attach extra values (e.g. byte counts) to a stage
+    # through the dict yielded by stage(). If a profile dir is given, each stage also runs
+    # under cProfile and its stats are dumped to <profile dir>/<target>.<stage>.prof.
+    #
+    # A disabled tracer writes no events or profiles, so instrumentation costs next to nothing
+    # unless requested. The latest duration and values of each target's stages are kept either
+    # way, for the timings log and the scheduler's history.
+
+    def __init__(self, enabled=False, profile_dir=None):
+        self.enabled = enabled or profile_dir is not None
+        self.profile_dir = profile_dir
+
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._events = []
+        self._tids = {}
+
+        # target name -> stage name -> (seconds, values)
+        self._stages = {}
+
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def _tid(self, target_name):
+        tid = self._tids.get(target_name)
+        if tid is None:
+            tid = len(self._tids) + 1
+            self._tids[target_name] = tid
+
+            self._events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": tid,
+                "args": {"name": target_name},
+            })
+
+        return tid
+
+    def _timestamp_us(self, t):
+        return (t - self._start) * 1e6
+
+    @contextlib.contextmanager
+    def stage(self, target_name, stage_name):
+        args = {}
+
+        profile = None
+        if self.profile_dir is not None:
+            profile = cProfile.Profile()
+            profile_lock.acquire()
+
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                profile.enable()
+
+            yield args
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile_lock.release()
+
+            end = time.perf_counter()
+
+            if profile is not None:
+                # Target names may be qualified as <label>/<arch>; profiles all go in profile_dir.
+                file_name = "{}.{}.prof".format(target_name.replace("/", "."), stage_name)
+                profile.dump_stats(os.path.join(self.profile_dir, file_name))
+
+            if self.enabled:
+                self_rss = max_rss_kb("self")
+                if self_rss is not None:
+                    args["generator_max_rss_kb"] = self_rss
+
+            with self._lock:
+                self._stages.setdefault(target_name, {})[stage_name] = (end - start, args)
+
+                if self.enabled:
+                    self._events.append({
+                        "name": stage_name,
+                        "cat": "stage",
+                        "ph": "X",
+                        "pid": 1,
+                        "tid": self._tid(target_name),
+                        "ts": self._timestamp_us(start),
+                        "dur": (end - start) * 1e6,
+                        "args": args,
+                    })
+
+    def reset_stages(self, target_name):
+        # Forgets the target's stage durations, before it is processed again (e.g. in watch mode).
+        with self._lock:
+            self._stages.pop(target_name, None)
+
+    def stage_durations(self, target_name):
+        # Returns a dict of stage name to seconds for the given target.
+        with self._lock:
+            stages = self._stages.get(target_name, {})
+            return {stage_name: seconds for stage_name, (seconds, _) in stages.items()}
+
+    def stage_values(self, target_name, stage_name):
+        # Returns the values attached to the given stage of the target, or an empty dict.
+        with self._lock:
+            stage = self._stages.get(target_name, {}).get(stage_name)
+            return dict(stage[1]) if stage is not None else {}
+
+    def write_trace(self, path):
+        with self._lock:
+            trace = {
+                "traceEvents": list(self._events),
+                "displayTimeUnit": "ms",
+                "otherData": {
+                    "generator_max_rss_kb": max_rss_kb("self"),
+                    "children_max_rss_kb": max_rss_kb("children"),
+                    "wall_seconds": time.perf_counter() - self._start,
+                },
+            }
+
+        with open(path, "w") as trace_file:
+            json.dump(trace, trace_file, indent=1)
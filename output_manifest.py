@@ -0,0 +1,122 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+# Name of the manifest file, stored in the output directory.
+MANIFEST_FILE_NAME = ".gen_manifest.json"
+
+# mkstemp creates files readable only by their owner; outputs should get the usual permissions.
+_umask = os.umask(0)
+os.umask(_umask)
+OUTPUT_FILE_MODE = 0o666 & ~_umask
+
+
+def digest_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    # Returns the digest of a file's contents, or None if it cannot be read.
+    try:
+        with open(path, "rb") as f:
+            return digest_bytes(f.read())
+    except OSError:
+        return None
+
+
+def source_digest(paths):
+    # Digest of the given source files, used to invalidate outputs when the generator itself changes.
+    hasher = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, "rb") as f:
+            hasher.update(f.read())
+
+    return hasher.hexdigest()
+
+
+def write_if_changed(path, data):
+    # Replaces the file at `path` with `data` (bytes), but only if its contents differ, so that
+    # unchanged files keep their modification times. The new contents are written to a temporary
+    # file in the same directory and renamed into place, so readers never see a partial file.
+    # Returns True if the file was written.
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, OUTPUT_FILE_MODE)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+    return True
+
+
+class OutputManifest:
+    # Records, per target, a digest of the inputs that produced its outputs and a digest of each
+    # output file. A target whose inputs digest is unchanged and whose outputs are all still intact
+    # does not need to be parsed or emitted again.
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+
+        self.entries = {}
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def is_up_to_date(self, name, inputs_digest, output_paths):
+        entry = self.entries.get(name)
+        if entry is None or entry["inputs"] != inputs_digest:
+            return False
+
+        # Outputs whose names depend on the target's details (e.g. CPU family files) are not
+        # known in advance, so output_paths need only be among the recorded outputs.
+        outputs = entry["outputs"]
+        if not set(os.path.abspath(path) for path in output_paths) <= set(outputs):
+            return False
+
+        return all(file_digest(path) == digest for path, digest in outputs.items())
+
+    def update(self, name, inputs_digest, details_digest, output_digests):
+        self.entries[name] = {
+            "inputs": inputs_digest,
+            "details": details_digest,
+            "outputs": {os.path.abspath(path): digest for path, digest in output_digests.items()},
+        }
+
+    def save(self):
+        data = json.dumps(self.entries, indent=4, sort_keys=True).encode()
+        write_if_changed(self.path, data)
@@ -20,258 +20,547 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import codecs
 import re
 import sys
 
+from blacklist import Blacklist
+
 class Feature:
+    __slots__ = ("id", "def_name", "llvm_name", "description", "dependencies")
+
     def __init__(self, id, def_name):
-        self.def_name = def_name
+        self.def_name = sys.intern(def_name)
         self.id = id
-        
+
         self.llvm_name = None
         self.description = None
-        self.dependencies = [0, 0, 0]
+
+        # Bitmap of implied features, indexed by feature id.
+        self.dependencies = 0
 
     def __str__(self):
-        return f"{self.id}: {self.def_name}({self.pretty_name}) = '{self.description}'"
+        return f"{self.id}: {self.def_name}({self.llvm_name}) = '{self.description}'"
 
 
 class Cpu:
-    def __init__(self, llvm_name, dependencies):
-        self.llvm_name = llvm_name
+    __slots__ = ("llvm_name", "dependencies", "tune_dependencies")
+
+    def __init__(self, llvm_name, dependencies, tune_dependencies=0):
+        self.llvm_name = sys.intern(llvm_name)
+
+        # Bitmaps of features, indexed by feature id. Tune features are only emitted by newer
+        # LLVM versions, and are 0 otherwise.
         self.dependencies = dependencies
+        self.tune_dependencies = tune_dependencies
 
     def __str__(self):
         return f"'{self.llvm_name}'"
 
 
-def is_bit_set(deps, idx):
-    bin = idx // 64
-    offset = idx % 64
-
-    return (deps[bin] & (1 << offset)) != 0
+class TargetDetails:
+    # Resolved features and CPUs of a target, stored as parallel arrays.
+    #
+    # Features are identified by their index into the feature arrays, which follow the order of
+    # the tablegen feature table with blacklisted features removed. Each dependency list is kept
+    # as a tuple of feature indices, in the order it is emitted. Bitmasks over feature indices,
+    # for set operations, are built on first use.
+    #
+    # to_json() and from_json() convert to and from the dict-based JSON schema, where
+    # dependencies are lists of def names.
+
+    __slots__ = (
+        "feature_def_names",
+        "feature_llvm_names",
+        "feature_descriptions",
+        "feature_dependencies",
+        "cpu_llvm_names",
+        "cpu_dependencies",
+        "_feature_dependency_masks",
+        "_cpu_dependency_masks",
+    )
+
+    def __init__(self):
+        self.feature_def_names = []
+        self.feature_llvm_names = []
+        self.feature_descriptions = []
+        self.feature_dependencies = []
+
+        self.cpu_llvm_names = []
+        self.cpu_dependencies = []
+
+        self._feature_dependency_masks = None
+        self._cpu_dependency_masks = None
+
+    @property
+    def feature_count(self):
+        return len(self.feature_def_names)
+
+    @property
+    def cpu_count(self):
+        return len(self.cpu_llvm_names)
+
+    @property
+    def feature_dependency_masks(self):
+        if self._feature_dependency_masks is None:
+            self._feature_dependency_masks = [indices_to_mask(deps) for deps in self.feature_dependencies]
+        return self._feature_dependency_masks
+
+    @property
+    def cpu_dependency_masks(self):
+        if self._cpu_dependency_masks is None:
+            self._cpu_dependency_masks = [indices_to_mask(deps) for deps in self.cpu_dependencies]
+        return self._cpu_dependency_masks
+
+    def add_feature(self, def_name, llvm_name, description, dependencies):
+        self.feature_def_names.append(def_name)
+        self.feature_llvm_names.append(llvm_name)
+        self.feature_descriptions.append(description)
+        self.feature_dependencies.append(tuple(dependencies))
+        self._feature_dependency_masks = None
+
+    def add_cpu(self, llvm_name, dependencies):
+        self.cpu_llvm_names.append(llvm_name)
+        self.cpu_dependencies.append(tuple(dependencies))
+        self._cpu_dependency_masks = None
+
+    def to_json(self):
+        def_names = self.feature_def_names
+
+        return {
+            "features": [
+                {
+                    "def_name": def_names[i],
+                    "llvm_name": self.feature_llvm_names[i],
+                    "description": self.feature_descriptions[i],
+                    "dependencies": [def_names[dep] for dep in self.feature_dependencies[i]],
+                }
+                for i in range(self.feature_count)
+            ],
+            "cpus": [
+                {
+                    "llvm_name": self.cpu_llvm_names[i],
+                    "dependencies": [def_names[dep] for dep in self.cpu_dependencies[i]],
+                }
+                for i in range(self.cpu_count)
+            ],
+        }
+
+    @staticmethod
+    def from_json(target_details):
+        details = TargetDetails()
+
+        index_by_def_name = {feature["def_name"]: i for i, feature in enumerate(target_details["features"])}
+
+        for feature in target_details["features"]:
+            details.add_feature(
+                sys.intern(feature["def_name"]),
+                sys.intern(feature["llvm_name"]),
+                feature["description"],
+                [index_by_def_name[dep] for dep in feature["dependencies"]])
+
+        for cpu in target_details["cpus"]:
+            details.add_cpu(
+                sys.intern(cpu["llvm_name"]),
+                [index_by_def_name[dep] for dep in cpu["dependencies"]])
+
+        return details
+
+
+def indices_to_mask(indices):
+    mask = 0
+    for index in indices:
+        mask |= 1 << index
+    return mask
+
+
+def iter_set_bits(mask):
+    # Yields the indices of the set bits of an integer, in ascending order.
+    while mask != 0:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+class DependencyResolver:
+    # Collapses dependency bitmaps according to a blacklist.
+    #
+    # Internally, features are identified by their position in the feature list and sets of
+    # features are integer bitmasks over those positions. Walking the set bits of a mask in
+    # ascending order visits features in list order, which keeps dependency lists in the same
+    # order as a linear scan over the feature list would produce.
+    #
+    # Blacklisted features are replaced by their own (collapsed) dependencies. Each blacklisted
+    # feature's collapsed list is computed once and memoized.
+
+    def __init__(self, features, blacklist):
+        self.features = features
+        self.position_by_id = {feature.id: i for i, feature in enumerate(features)}
+
+        # Blacklisting is a bit test on this mask rather than a lookup by name.
+        self.blacklisted = self.position_mask(blacklist.mask(features))
+
+        self._collapsed = {}
+        self._in_progress = 0
+
+    def is_blacklisted(self, position):
+        return (self.blacklisted >> position) & 1 != 0
+
+    def position_mask(self, deps):
+        # Converts a dependency bitmap indexed by feature id into a mask over list positions.
+        # Features without a list entry (see parse_info_lines) are dropped.
+        mask = 0
+        for feature_id in iter_set_bits(deps):
+            position = self.position_by_id.get(feature_id)
+            if position is not None:
+                mask |= 1 << position
+
+        return mask
+
+    def _collapse(self, position):
+        # Returns (positions, cut): the collapsed dependency positions of a blacklisted feature,
+        # and a mask of in-progress features whose expansion was cut short to break a cycle.
+        collapsed = self._collapsed.get(position)
+        if collapsed is not None:
+            return collapsed, 0
+
+        position_bit = 1 << position
+        if self._in_progress & position_bit:
+            # Cycle through blacklisted features. The outer expansion of this feature already
+            # gathers its dependencies, so contribute nothing here.
+            return [], position_bit
+
+        self._in_progress |= position_bit
+        positions, cut = self._gather(self.position_mask(self.features[position].dependencies))
+        self._in_progress &= ~position_bit
+
+        cut &= ~position_bit
+
+        # A result that depends on a cut-short expansion of some other feature is incomplete
+        # from any other entry point, so only complete results are memoized.
+        if cut == 0:
+            self._collapsed[position] = positions
+
+        return positions, cut
+
+    def _gather(self, mask):
+        positions = []
+        seen = 0
+        cut = 0
+
+        for position in iter_set_bits(mask):
+            if self.is_blacklisted(position):
+                # Even though this is blacklisted, its deps might not be.
+                collapsed, collapsed_cut = self._collapse(position)
+                cut |= collapsed_cut
+
+                for dep in collapsed:
+                    if not (seen >> dep) & 1:
+                        seen |= 1 << dep
+                        positions.append(dep)
+            elif not (seen >> position) & 1:
+                seen |= 1 << position
+                positions.append(position)
+
+        return positions, cut
+
+    def gather_dependencies(self, deps):
+        # Given a dep bitmap, gather a list of dep positions, in accordance with the blacklist.
+        # None of the returned positions are blacklisted.
+        positions, _ = self._gather(self.position_mask(deps))
+        return positions
 
 
-def gather_dependencies(deps, features, blacklist):
-    # Given a list of features and a dep bitmap, gather a list of dep def_names,
-    # in accordance with the blacklist.
-    
-    features_by_id = {feature.id: feature for feature in features}
-
-    dep_def_names = []
+def resolve_details(features, cpus, blacklist):
+    # Basic idea: resolve the dependency bitmaps according to the blacklist. 
+    # Returns a TargetDetails.
 
-    for feature in features:
-        if is_bit_set(deps, feature.id):
-            if feature.def_name in blacklist:
-                # Explore its dependencies. Even though this is blacklisted, its deps might not be.
-                blacklisted_deps = gather_dependencies(feature.dependencies, features, blacklist)
-                for dep in blacklisted_deps:
-                    if dep not in dep_def_names:
-                        dep_def_names.append(dep)
-            else:
-                if feature.def_name not in dep_def_names:
-                    dep_def_names.append(feature.def_name)
+    # blacklist is a Blacklist, or any iterable of entries.
+    if not isinstance(blacklist, Blacklist):
+        blacklist = Blacklist(blacklist)
 
-    return dep_def_names
+    resolver = DependencyResolver(features, blacklist)
 
+    target_details = TargetDetails()
 
-def resolve_details(features, cpus, blacklist):
-    # Basic idea: resolve the dependency bitmaps according to the blacklist. 
+    # Maps positions in `features` to indices in target_details (None for blacklisted features).
+    index_by_position = []
+    index = 0
 
-    target_details = {
-        "features": [],
-        "cpus": []
-    }
+    for position in range(len(features)):
+        if resolver.is_blacklisted(position):
+            index_by_position.append(None)
+        else:
+            index_by_position.append(index)
+            index += 1
 
-    for feature in features:
+    for position, feature in enumerate(features):
         # Turn its dependency bitmap into a nice list.
         
-        if feature.def_name in blacklist:
+        if resolver.is_blacklisted(position):
             continue
         
-        dependency_def_names = gather_dependencies(feature.dependencies, features, blacklist)
+        dependencies = [index_by_position[dep] for dep in resolver.gather_dependencies(feature.dependencies)]
 
-        target_details["features"].append({
-            "def_name": feature.def_name,
-            "llvm_name": feature.llvm_name,
-            "description": feature.description,
-            "dependencies": dependency_def_names
-        })
+        target_details.add_feature(feature.def_name, feature.llvm_name, feature.description, dependencies)
 
     for cpu in cpus:
-        dependency_def_names = gather_dependencies(cpu.dependencies, features, blacklist)
+        dependencies = [index_by_position[dep] for dep in resolver.gather_dependencies(cpu.dependencies)]
 
-        target_details["cpus"].append({
-            "llvm_name": cpu.llvm_name,
-            "dependencies": dependency_def_names
-        })
+        target_details.add_cpu(cpu.llvm_name, dependencies)
 
     return target_details    
 
 
-def parse_info_lines(feature_def_lines, feature_info_lines, cpu_info_lines):
-    feature_def_re = re.compile(r"\s*(?P<def_name>\w+)\s*=\s*(?P<def_value>\d+).*")
-
-    features = []
-    features_by_def_name = {}
-
-    for def_line in feature_def_lines:
-        m = feature_def_re.match(def_line)
-        if m is None:
-            print("[!] Invalid feature def line (internal error)!", file=sys.stderr)
-            sys.exit(1)
-
-        def_name = m.group("def_name")
-        def_value = int(m.group("def_value"))
-
-        if def_name == "NumSubtargetFeatures":
-            continue
-
-        # The enum members are always 0-n, in-order.
-        feature = Feature(def_value, def_name)
-        features.append(feature)
-        features_by_def_name[feature.def_name] = feature
-    
-    # "a35", "Cortex-A35 ARM processors", AArch64::ProcA35,    0x20800080800800ULL, 0x0ULL, 0x0ULL,    ,
-    feature_info_re = re.compile(
-        r'\s*"(?P<pretty_name>.*)",'
-        r'\s*"(?P<description>.*)",'
-        r"\s*.*::(?P<def_name>.*),"
-        r"\s*(?P<b0>[0-9a-fA-FxX]+)ULL,"
-        r"\s*(?P<b1>[0-9a-fA-FxX]+)ULL,"
-        r"\s*(?P<b2>[0-9a-fA-FxX]+)ULL,"
-        r".*")
-
-    # Some features, for whatever reason, cannot be provided on the command line.
-    # They do not have an entry in the feature info section.
-    # So here, we collect the features that do show up here.
-    real_features = []
-
-    for info_line in feature_info_lines:
-        # Removing braces will make these easier to parse.
-        info_line = info_line.replace("{", "")
-        info_line = info_line.replace("}", "")
-
-        m = feature_info_re.match(info_line)
-        if m is None:
-            print("[!] Invalid feature info line (internal error)!", file=sys.stderr)
-            sys.exit(1)
+# Matches the { { { 0x...ULL, ... } } } initializer of a bitmap, capturing its words.
+bitmap_re = re.compile(r"\{\s*\{\s*\{(?P<words>[^{}]*)\}\s*\}\s*\}")
+bitmap_word_re = re.compile(r"0x([0-9a-fA-F]+)ULL")
 
-        def_name = m.group("def_name")
+feature_row_prefix = (
+    r'\s*\{\s*"(?P<llvm_name>(?:[^"\\]|\\.)*)",'
+    r'\s*"(?P<description>(?:[^"\\]|\\.)*)",'
+    r"\s*[\w:]*::(?P<def_name>\w+),\s*")
 
-        feature = features_by_def_name[def_name]
+cpu_row_prefix = r'\s*\{\s*"(?P<llvm_name>(?:[^"\\]|\\.)*)",\s*'
 
-        feature.llvm_name = m.group("pretty_name")
-        feature.description = m.group("description")
 
-        b0 = int(m.group("b0"), 16)
-        b1 = int(m.group("b1"), 16)
-        b2 = int(m.group("b2"), 16)
+def parse_bitmap(words):
+    # Converts the words of a bitmap initializer (least significant word first) into a single int.
+    hex_words = bitmap_word_re.findall(words)
+    hex_words.reverse()
 
-        feature.dependencies = [b0, b1, b2]
+    return int("".join(word.zfill(16) for word in hex_words) or "0", 16)
 
-        real_features.append(feature)
 
-    # "apple-latest", 0x0ULL, 0x0ULL, 0x10ULL, , &CycloneModel ,
-    cpu_info_re = re.compile(
-        r'\s*"(?P<pretty_name>.*)",'
-        r"\s*(?P<b0>[0-9a-fA-FxX]+)ULL,"
-        r"\s*(?P<b1>[0-9a-fA-FxX]+)ULL,"
-        r"\s*(?P<b2>[0-9a-fA-FxX]+)ULL,"
-        r".*")
+class RowLayout:
+    # Describes the rows of a feature or CPU table. The layout varies between LLVM versions:
+    # the number of words per bitmap grows with the number of features, and newer versions add
+    # a tune feature bitmap to CPU rows. It is detected from the first row of a table, and the
+    # resulting row regex captures each bitmap as a named group b0, b1, ...
 
-    cpus = []
+    def __init__(self, prefix_pattern, sample_row):
+        bitmaps = bitmap_re.findall(sample_row)
+        if len(bitmaps) == 0:
+            print("[!] Unrecognized table row layout (internal error)!", file=sys.stderr)
+            sys.exit(1)
 
-    for info_line in cpu_info_lines:
-        info_line = info_line.replace("{", "")
-        info_line = info_line.replace("}", "")
-        
-        m = cpu_info_re.match(info_line)
-        if m is None:
-            print("[!] Invalid cpu info line (internal error)!", file=sys.stderr)
+        self.bitmap_count = len(bitmaps)
+        self.word_count = len(bitmap_word_re.findall(bitmaps[0]))
+
+        words_pattern = r"(?:\s*0x[0-9a-fA-F]+ULL\s*,?){%d}\s*" % self.word_count
+        bitmap_patterns = [
+            r"\{\s*\{\s*\{(?P<b%d>%s)\}\s*\}\s*\}" % (i, words_pattern)
+            for i in range(self.bitmap_count)
+        ]
+
+        self.row_re = re.compile(prefix_pattern + r",\s*".join(bitmap_patterns))
+
+    def match(self, row):
+        return self.row_re.match(row)
+
+
+feature_def_re = re.compile(r"\s*(?P<def_name>\w+)\s*=\s*(?P<def_value>\d+).*")
+
+# Parser states, in the order they occur in the tablegen output.
+SEEK_ENUM = 0
+IN_ENUM = 1
+SEEK_FEATURES = 2
+IN_FEATURES = 3
+SEEK_CPUS = 4
+IN_CPUS = 5
+DONE = 6
+
+# Text that starts the section each seek state is looking for.
+section_markers = {
+    SEEK_ENUM: "enum {",
+    SEEK_FEATURES: "extern const llvm::SubtargetFeatureKV",
+    SEEK_CPUS: "extern const llvm::SubtargetSubTypeKV",
+}
+
+# Size of the chunks read by parse_tablegen_file.
+CHUNK_SIZE = 1 << 16
+
+
+class TablegenParser:
+    # Incremental, single-pass parser for `llvm-tblgen --gen-subtarget` output.
+    #
+    # The output is consumed in three sections:
+    #   1. Feature definition (the feature enum).
+    #   2. Feature dependency info (the SubtargetFeatureKV table).
+    #   3. CPU definition and dependency info (the SubtargetSubTypeKV table).
+    #
+    # Data is fed in arbitrary chunks of text or UTF-8 bytes, so it can come from a file, an mmap
+    # or a pipe. Records are built as lines arrive, and everything between sections is skipped by
+    # searching for the next section's marker rather than inspecting each line. Once the CPU table
+    # is closed, `done` is set and further input is ignored, so callers can stop reading there.
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._state = SEEK_ENUM
+
+        self._features_by_def_name = {}
+
+        # Some features, for whatever reason, cannot be provided on the command line.
+        # They do not have an entry in the feature info section.
+        # So here, we collect the features that do show up there.
+        self._real_features = []
+        self._cpus = []
+
+        self._row_layout = None
+
+    @property
+    def done(self):
+        return self._state == DONE
+
+    def feed(self, data):
+        if self.done:
+            return
+
+        if not isinstance(data, str):
+            data = self._decoder.decode(data)
+
+        self._buffer += data
+        self._process()
+
+    def finish(self):
+        # Returns (features, cpus) once all sections have been parsed.
+        if not self.done:
+            print("[!] Unexpected end of tablegen output!", file=sys.stderr)
             sys.exit(1)
 
-        llvm_name = m.group("pretty_name")
+        return (self._real_features, self._cpus)
 
-        b0 = int(m.group("b0"), 16)
-        b1 = int(m.group("b1"), 16)
-        b2 = int(m.group("b2"), 16)
+    def _process(self):
+        buffer = self._buffer
+        pos = 0
 
-        cpus.append(Cpu(llvm_name, [b0, b1, b2]))
+        while self._state != DONE:
+            marker = section_markers.get(self._state)
 
-    return (real_features, cpus)
+            if marker is not None:
+                marker_pos = buffer.find(marker, pos)
+                if marker_pos < 0:
+                    # Keep the trailing partial line, which may hold the start of a marker.
+                    pos = max(pos, buffer.rfind("\n") + 1)
+                    break
 
+                line_start = buffer.rfind("\n", 0, marker_pos) + 1
+                line_end = buffer.find("\n", marker_pos)
+                if line_end < 0:
+                    pos = line_start
+                    break
 
-def parse_tablegen_file(tablegen_file, blacklist):
-    # Scan through file, line by line.
-    # Attack this in three sections:
-    #   1. Feature definition.
-    #   2. Feature dependency info.
-    #   3. CPU definition and dependency info.
+                line = buffer[line_start:line_end]
+                pos = line_end + 1
 
-    find_enum_start_re = re.compile(r"\s*enum \{\s*")
+                if self._is_section_start(line, marker):
+                    self._state += 1
+            else:
+                line_end = buffer.find("\n", pos)
+                if line_end < 0:
+                    break
+
+                line = buffer[pos:line_end]
+                pos = line_end + 1
+
+                if line.lstrip().startswith("};"):
+                    self._state += 1
+                    self._row_layout = None
+                else:
+                    self._parse_line(line)
+
+        self._buffer = buffer[pos:]
+
+    def _is_section_start(self, line, marker):
+        line = line.lstrip()
+        if not line.startswith(marker):
+            return False
+
+        # The tables are definitions (`... = {`), not declarations.
+        return self._state == SEEK_ENUM or "=" in line[len(marker):]
+
+    def _parse_line(self, line):
+        if self._state == IN_ENUM:
+            self._parse_feature_def(line)
+        elif self._state == IN_FEATURES:
+            self._parse_feature_info(line)
+        else:
+            self._parse_cpu_info(line)
+
+    def _parse_feature_def(self, line):
+        m = feature_def_re.match(line)
+        if m is None:
+            print("[!] Invalid feature def line (internal error)!", file=sys.stderr)
+            sys.exit(1)
 
-    # Move past start of enum.
-    while True:
-        line = tablegen_file.readline()
+        def_name = m.group("def_name")
+        def_value = int(m.group("def_value"))
 
-        if find_enum_start_re.match(line) is not None:
-            break
-    
-    find_enum_end_re = re.compile(r"\s*\};\s*")
-    feature_def_lines = []
+        if def_name == "NumSubtargetFeatures":
+            return
 
-    # Find end of enum, while adding encountered lines to list.
-    while True:
-        line = tablegen_file.readline()
+        # The enum members are always 0-n, in-order.
+        feature = Feature(def_value, def_name)
+        self._features_by_def_name[feature.def_name] = feature
 
-        if find_enum_end_re.match(line) is not None:
-            break
+    def _parse_feature_info(self, line):
+        # { "a35", "Cortex-A35 ARM processors", AArch64::ProcA35, { { { 0x20800080800800ULL, 0x0ULL, 0x0ULL, } } } },
+        if self._row_layout is None:
+            self._row_layout = RowLayout(feature_row_prefix, line)
 
-        feature_def_lines.append(line)
+        m = self._row_layout.match(line)
+        if m is None:
+            print("[!] Invalid feature info line (internal error)!", file=sys.stderr)
+            sys.exit(1)
 
-    find_features_start_re = re.compile(r"\s*extern const llvm::SubtargetFeatureKV.*=.*")
+        feature = self._features_by_def_name[m.group("def_name")]
 
-    # Find the start of feature dep info.
-    while True:
-        line = tablegen_file.readline()
+        feature.llvm_name = sys.intern(m.group("llvm_name"))
+        feature.description = m.group("description")
+        feature.dependencies = parse_bitmap(m.group("b0"))
 
-        if find_features_start_re.match(line) is not None:
-            break
+        self._real_features.append(feature)
 
-    feature_info_lines = []
+    def _parse_cpu_info(self, line):
+        # { "apple-latest", { { { 0x0ULL, 0x0ULL, 0x10ULL, } } }, &CycloneModel },
+        # Newer LLVM versions add a tune feature bitmap after the feature bitmap.
+        if self._row_layout is None:
+            self._row_layout = RowLayout(cpu_row_prefix, line)
 
-    # Find the end of the feature dep info, while adding encountered lines to list.
-    # End-of-enum re can be used here for the end of the feature array.
-    while True:
-        line = tablegen_file.readline()
+        m = self._row_layout.match(line)
+        if m is None:
+            print("[!] Invalid cpu info line (internal error)!", file=sys.stderr)
+            sys.exit(1)
 
-        if find_enum_end_re.match(line) is not None:
-            break
+        dependencies = parse_bitmap(m.group("b0"))
 
-        feature_info_lines.append(line)
+        tune_dependencies = 0
+        if self._row_layout.bitmap_count > 1:
+            tune_dependencies = parse_bitmap(m.group("b1"))
 
-    find_cpus_start_re = re.compile(r"\s*extern const llvm::SubtargetSubTypeKV.*=.*")
+        self._cpus.append(Cpu(m.group("llvm_name"), dependencies, tune_dependencies))
 
-    # Find the start of CPU info.
-    while True:
-        line = tablegen_file.readline()
 
-        if find_cpus_start_re.match(line) is not None:
-            break
+def parse_tablegen_records(tablegen_file, parser=None):
+    # Parses tablegen output from any object with a read() method returning text or bytes
+    # (a file, an mmap, a pipe, ...), returning (features, cpus). Reading stops as soon as the
+    # CPU table has been parsed. Another parser with the same interface (such as a
+    # parse_tablegen_json.TablegenJsonParser) can be passed in to read other formats.
+    if parser is None:
+        parser = TablegenParser()
 
-    cpu_info_lines = []
+    while not parser.done:
+        chunk = tablegen_file.read(CHUNK_SIZE)
+        if len(chunk) == 0:
+            break
 
-    # Find the end of the cpu info, while adding encountered lines to list.
-    # As above, end-of-enum re can be used here.
-    while True:
-        line = tablegen_file.readline()
+        parser.feed(chunk)
 
-        if find_enum_end_re.match(line) is not None:
-            break
+    return parser.finish()
 
-        cpu_info_lines.append(line)
 
-    features, cpus = parse_info_lines(feature_def_lines, feature_info_lines, cpu_info_lines)
+def parse_tablegen_file(tablegen_file, blacklist):
+    features, cpus = parse_tablegen_records(tablegen_file)
 
     return resolve_details(features, cpus, blacklist)
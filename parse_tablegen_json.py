@@ -0,0 +1,428 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Frontend for `llvm-tblgen --dump-json` output, as an alternative to scraping the C++ tables
+# of `--gen-subtarget`.
+#
+# The dump is one JSON object mapping every record name to its fields, which runs to hundreds
+# of MB for the larger targets, so it is never loaded whole. Instead, it is read incrementally,
+# one top-level record at a time, keeping only SubtargetFeature and Processor records. The
+# top-level "!..." entries (notably "!instanceof", which lists every record of every class and
+# is the largest single value) are skipped by scanning brackets and strings, without decoding.
+#
+# The records are turned into the same Feature/Cpu model as parse_tablegen produces, following
+# what SubtargetEmitter does: feature ids are assigned in def name order (comparing runs of
+# digits numerically), features with an empty name are left out of the feature table, and both
+# tables are sorted by name.
+
+import argparse
+import codecs
+import functools
+import json
+import re
+import sys
+
+from parse_tablegen import CHUNK_SIZE, Cpu, Feature, parse_tablegen_records, resolve_details
+
+whitespace_re = re.compile(r"\s*")
+
+# A scalar value (number, true, false, null) at the top level, followed by a delimiter.
+scalar_re = re.compile(r"[^,}\s]+(?=[,}\s])")
+
+# Inside a skipped value: a run of anything but brackets, with strings (which may contain
+# brackets) matched whole, and the rest of a string cut off by the end of the buffer.
+skip_run_re = re.compile(r'(?:[^\[\]{}"]+|"(?:[^"\\]|\\.)*")*')
+skip_string_re = re.compile(r'(?:[^"\\]|\\.)*')
+
+# States of TablegenJsonParser.
+SEEK_OBJECT = 0
+SEEK_KEY = 1
+SEEK_COLON = 2
+SEEK_VALUE = 3
+SKIP_VALUE = 4
+DONE = 5
+
+json_decoder = json.JSONDecoder()
+
+
+def compare_numeric(lhs, rhs):
+    # Port of LLVM's StringRef::compare_numeric, which orders runs of digits by their value
+    # (a longer run being larger) and everything else by character.
+    i = 0
+    end = min(len(lhs), len(rhs))
+    while i < end:
+        if lhs[i].isdigit() and rhs[i].isdigit():
+            j = i + 1
+            while True:
+                lhs_digit = j < len(lhs) and lhs[j].isdigit()
+                rhs_digit = j < len(rhs) and rhs[j].isdigit()
+                if lhs_digit != rhs_digit:
+                    return -1 if rhs_digit else 1
+                if not rhs_digit:
+                    break
+                j += 1
+
+            if lhs[i:j] != rhs[i:j]:
+                return -1 if lhs[i:j] < rhs[i:j] else 1
+
+            i = j
+            continue
+
+        if lhs[i] != rhs[i]:
+            return -1 if lhs[i] < rhs[i] else 1
+        i += 1
+
+    if len(lhs) == len(rhs):
+        return 0
+    return -1 if len(lhs) < len(rhs) else 1
+
+
+def c_string_escape(string):
+    # Escapes a decoded string the way it appears inside a string literal of --gen-subtarget
+    # output, which is how the C++ frontend (and so the emitted Zig source) carries it.
+    escaped = []
+    for char in string:
+        if char == "\\" or char == '"':
+            escaped.append("\\" + char)
+        elif ord(char) < 0x20 or ord(char) == 0x7f:
+            escaped.append("\\x{:02x}".format(ord(char)))
+        else:
+            escaped.append(char)
+    return "".join(escaped)
+
+
+def def_names(values):
+    # Record names of a list of `{"def": ..., "kind": "def", ...}` references.
+    return [value["def"] for value in values if value.get("kind") == "def"]
+
+
+class TablegenJsonParser:
+    # Incremental parser for `llvm-tblgen --dump-json` output, with the same interface as
+    # parse_tablegen.TablegenParser: feed() chunks of text or UTF-8 bytes, then finish().
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._state = SEEK_OBJECT
+        self._key = None
+
+        # Unprocessed text is the buffer followed by the chunks fed since, which are only joined
+        # onto it when there may be a complete value to decode, so that feeding a chunk does not
+        # copy everything pending.
+        self._buffer = ""
+        self._chunks = []
+        self._pending_length = 0
+
+        # A value that could not be decoded yet is only retried once the pending text reaches
+        # this length, so that a value spanning many chunks is not decoded over and over.
+        self._retry_length = 0
+
+        # Scanning state of a value being skipped: bracket depth, and whether inside a string
+        # or right after a backslash in one.
+        self._skip_depth = 0
+        self._skip_in_string = False
+        self._skip_escape = False
+
+        # def name -> (name, description, implied def names)
+        self._features = {}
+
+        # (name, feature def names, tune feature def names)
+        self._processors = []
+
+    @property
+    def done(self):
+        return self._state == DONE
+
+    def feed(self, data):
+        if self.done:
+            return
+
+        if not isinstance(data, str):
+            data = self._decoder.decode(data)
+
+        self._chunks.append(data)
+        self._pending_length += len(data)
+        if self._pending_length >= self._retry_length:
+            self._process()
+
+    def finish(self):
+        # Returns (features, cpus) once the whole dump has been parsed.
+        if not self.done:
+            # Retry whatever was held back waiting for more data.
+            self._retry_length = 0
+            self._process()
+
+        if not self.done:
+            print("[!] Unexpected end of tablegen JSON output!", file=sys.stderr)
+            sys.exit(1)
+
+        # Feature ids follow the enum SubtargetEmitter writes, which sorts def names numerically.
+        ordered_def_names = sorted(self._features, key=functools.cmp_to_key(compare_numeric))
+        feature_by_def_name = {}
+        for id, def_name in enumerate(ordered_def_names):
+            feature_by_def_name[def_name] = Feature(id, def_name)
+
+        def to_bitmap(names):
+            bitmap = 0
+            for name in names:
+                feature = feature_by_def_name.get(name)
+                if feature is not None:
+                    bitmap |= 1 << feature.id
+            return bitmap
+
+        real_features = []
+        for def_name, (name, description, implies) in self._features.items():
+            feature = feature_by_def_name[def_name]
+            feature.llvm_name = sys.intern(name)
+            feature.description = description
+            feature.dependencies = to_bitmap(implies)
+
+            # Features without a name cannot be given on the command line, and are left out of
+            # the feature table.
+            if len(name) > 0:
+                real_features.append(feature)
+
+        real_features.sort(key=lambda feature: feature.llvm_name)
+
+        cpus = [
+            Cpu(name, to_bitmap(features), to_bitmap(tune_features))
+            for name, features, tune_features in sorted(self._processors, key=lambda processor: processor[0])
+        ]
+
+        return (real_features, cpus)
+
+    def _process(self):
+        # Top-level keys and values are decoded whole with the (C-accelerated) json decoder.
+        # A value cut off by the end of the buffer fails to decode, and is retried when more
+        # data has arrived.
+        self._chunks.insert(0, self._buffer)
+        buffer = "".join(self._chunks)
+        self._chunks = []
+
+        pos = 0
+
+        while self._state != DONE:
+            pos = whitespace_re.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+
+            char = buffer[pos]
+
+            if self._state == SEEK_OBJECT:
+                self._expect(char, "{")
+                pos += 1
+                self._state = SEEK_KEY
+            elif self._state == SEEK_KEY:
+                if char == ",":
+                    pos += 1
+                elif char == "}":
+                    pos += 1
+                    self._state = DONE
+                else:
+                    self._expect(char, '"')
+                    key, end = self._decode(buffer, pos)
+                    if end is None:
+                        break
+
+                    self._key = key
+                    pos = end
+                    self._state = SEEK_COLON
+            elif self._state == SEEK_COLON:
+                self._expect(char, ":")
+                pos += 1
+                self._state = SEEK_VALUE
+            elif self._state == SKIP_VALUE:
+                end = self._skip(buffer, pos)
+                if end is None:
+                    pos = len(buffer)
+                    break
+
+                pos = end
+                self._state = SEEK_KEY
+            elif char in '{["' and self._key.startswith("!"):
+                # Entries such as "!instanceof" are not records.
+                self._skip_depth = 0
+                self._skip_in_string = False
+                self._skip_escape = False
+                self._state = SKIP_VALUE
+            elif char in '{["':
+                value, end = self._decode(buffer, pos)
+                if end is None:
+                    break
+
+                self._record(self._key, value)
+                pos = end
+                self._state = SEEK_KEY
+            else:
+                # Top-level scalars, such as the format version, are not needed.
+                m = scalar_re.match(buffer, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                self._state = SEEK_KEY
+
+        self._buffer = buffer[pos:]
+        self._pending_length = len(self._buffer)
+
+    def _skip(self, buffer, pos):
+        # Scans a value without decoding it, from where the previous call left off. Returns the
+        # position after the value, or None if it continues past the end of the buffer.
+        while True:
+            if self._skip_in_string:
+                if self._skip_escape:
+                    if pos == len(buffer):
+                        return None
+                    pos += 1
+                    self._skip_escape = False
+
+                pos = skip_string_re.match(buffer, pos).end()
+                if pos == len(buffer):
+                    return None
+                if buffer[pos] == "\\":
+                    # A backslash at the very end, whose escaped character is yet to come.
+                    self._skip_escape = True
+                    pos += 1
+                    continue
+
+                pos += 1
+                self._skip_in_string = False
+                if self._skip_depth == 0:
+                    return pos
+                continue
+
+            if self._skip_depth > 0:
+                pos = skip_run_re.match(buffer, pos).end()
+                if pos == len(buffer):
+                    return None
+
+            char = buffer[pos]
+            pos += 1
+            if char == '"':
+                self._skip_in_string = True
+            elif char in "[{":
+                self._skip_depth += 1
+            else:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    return pos
+
+    def _decode(self, buffer, pos):
+        # Returns (value, end), or (None, None) if the value is incomplete.
+        try:
+            value, end = json_decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            self._retry_length = 2 * (len(buffer) - pos)
+            return None, None
+
+        self._retry_length = 0
+        return value, end
+
+    def _expect(self, char, expected):
+        if char != expected:
+            print("[!] Invalid tablegen JSON output: expected '{}' but found '{}'!".format(expected, char), file=sys.stderr)
+            sys.exit(1)
+
+    def _record(self, key, record):
+        if not isinstance(record, dict):
+            return
+
+        superclasses = record.get("!superclasses", [])
+
+        if "SubtargetFeature" in superclasses:
+            self._features[key] = (c_string_escape(record["Name"]), c_string_escape(record["Desc"]), def_names(record["Implies"]))
+        elif "Processor" in superclasses:
+            self._processors.append((c_string_escape(record["Name"]), def_names(record["Features"]), def_names(record.get("TuneFeatures", []))))
+
+
+def parse_tablegen_json_records(tablegen_file):
+    # Parses `--dump-json` output from any object with a read() method returning text or bytes,
+    # returning (features, cpus).
+    return parse_tablegen_records(tablegen_file, TablegenJsonParser())
+
+
+def compare_frontends(dump_json_path, subtarget_path, blacklist=(), chunk_size=CHUNK_SIZE):
+    # Resolves a target's `--dump-json` output (fed in chunks of chunk_size bytes) and its
+    # `--gen-subtarget` output, returning lines describing where they disagree, if anywhere.
+    parser = TablegenJsonParser()
+    with open(dump_json_path, "rb") as dump_file:
+        while not parser.done:
+            chunk = dump_file.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            parser.feed(chunk)
+    details = resolve_details(*parser.finish(), blacklist).to_json()
+
+    with open(subtarget_path, "rb") as subtarget_file:
+        expected = resolve_details(*parse_tablegen_records(subtarget_file), blacklist).to_json()
+
+    differences = []
+    for key in ("features", "cpus"):
+        for ours, theirs in zip(details[key], expected[key]):
+            if ours != theirs:
+                differences.append("json:      {}".format(ours))
+                differences.append("subtarget: {}".format(theirs))
+                break
+        if len(details[key]) != len(expected[key]):
+            differences.append("{}: {} from json, {} from subtarget".format(key, len(details[key]), len(expected[key])))
+
+    return differences
+
+
+def main():
+    # Parses a `--dump-json` file and prints its resolved details as JSON, or, with -compare,
+    # checks that they match those parsed from the same target's `--gen-subtarget` output.
+    arg_parser = argparse.ArgumentParser(
+        description="Parse llvm-tblgen --dump-json output into target details.",
+        allow_abbrev=False)
+
+    arg_parser.add_argument(
+        "dump_json_file",
+        help="llvm-tblgen --dump-json output of a target")
+    arg_parser.add_argument(
+        "-compare",
+        default=None,
+        help="(default: <none>) llvm-tblgen --gen-subtarget output of the same target to compare against, instead of printing")
+    arg_parser.add_argument(
+        "-blacklist",
+        default=[],
+        nargs="*",
+        help="(default: <none>) feature def names to blacklist")
+
+    args = arg_parser.parse_args()
+
+    if args.compare is None:
+        with open(args.dump_json_file, "rb") as dump_file:
+            details = resolve_details(*parse_tablegen_json_records(dump_file), args.blacklist).to_json()
+        print(json.dumps(details, indent=4))
+        return
+
+    differences = compare_frontends(args.dump_json_file, args.compare, args.blacklist)
+    if len(differences) > 0:
+        print("[!] {} and {} disagree!".format(args.dump_json_file, args.compare), file=sys.stderr)
+        for line in differences:
+            print("    " + line, file=sys.stderr)
+        sys.exit(1)
+
+    print("= {} matches {}".format(args.dump_json_file, args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Answers questions about generated target details, such as which CPUs imply a feature or what
+# the full feature set of a CPU is, e.g.:
+#
+#   python3 query.py out closure x86 skylake
+#   python3 query.py out implied-by avx2
+#   python3 query.py out minimal-cpu x86 avx2 bmi2
+#
+# Details are read from the <arch>.bin or <arch>.json files written by gen.py. Each arch is
+# indexed as bitmasks: the transitive closure of every feature and CPU (the closure matrix, one
+# row per feature), the features implying each feature, and the CPUs implying each feature.
+# Queries are then a few integer operations. With -index, indexes are kept in an SQLite
+# database and only rebuilt for arches whose details file changed.
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+
+from details_bin import DetailsFile
+from feature_graph import closure_of, feature_closures
+from gen import TARGETS
+from output_manifest import file_digest
+from parse_tablegen import TargetDetails, iter_set_bits
+
+# Bump when the index layout or its derivation changes, to invalidate persisted indexes.
+INDEX_VERSION = 1
+
+
+def mask_to_blob(mask):
+    return mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+
+def blob_to_mask(blob):
+    return int.from_bytes(blob, "little")
+
+
+class ArchIndex:
+    # Bitmask indexes over one arch's features and CPUs. Features and CPUs are identified by
+    # their index in the target details; masks over features use feature indices as bits and
+    # masks over CPUs use CPU indices.
+
+    def __init__(self, arch_name, feature_names, cpu_names, feature_closures, cpu_closures, implied_by, cpus_by_feature):
+        self.arch_name = arch_name
+        self.feature_names = feature_names
+        self.cpu_names = cpu_names
+
+        # Features each feature or CPU transitively implies.
+        self.feature_closures = feature_closures
+        self.cpu_closures = cpu_closures
+
+        # Features that transitively imply each feature, and CPUs whose closure includes it.
+        self.implied_by = implied_by
+        self.cpus_by_feature = cpus_by_feature
+
+        self.feature_by_name = {name: i for i, name in enumerate(feature_names)}
+        self.cpu_by_name = {name: i for i, name in enumerate(cpu_names)}
+
+    @staticmethod
+    def build(arch_name, target_details):
+        closures = feature_closures(target_details)
+        cpu_closures = [closure_of(mask, closures) for mask in target_details.cpu_dependency_masks]
+
+        implied_by = [0] * target_details.feature_count
+        for feature, closure in enumerate(closures):
+            for dep in iter_set_bits(closure):
+                implied_by[dep] |= 1 << feature
+
+        cpus_by_feature = [0] * target_details.feature_count
+        for cpu, closure in enumerate(cpu_closures):
+            for feature in iter_set_bits(closure):
+                cpus_by_feature[feature] |= 1 << cpu
+
+        return ArchIndex(
+            arch_name,
+            list(target_details.feature_llvm_names),
+            list(target_details.cpu_llvm_names),
+            closures,
+            cpu_closures,
+            implied_by,
+            cpus_by_feature)
+
+    def feature_names_of(self, mask):
+        return [self.feature_names[i] for i in iter_set_bits(mask)]
+
+    def cpu_names_of(self, mask):
+        return [self.cpu_names[i] for i in iter_set_bits(mask)]
+
+    def closure(self, name):
+        # Names of the features implied by the feature or CPU `name` (CPUs take precedence),
+        # or None if there is no such feature or CPU.
+        cpu = self.cpu_by_name.get(name)
+        if cpu is not None:
+            return self.feature_names_of(self.cpu_closures[cpu])
+
+        feature = self.feature_by_name.get(name)
+        if feature is not None:
+            return self.feature_names_of(self.feature_closures[feature])
+
+        return None
+
+    def reverse_dependencies(self, feature_name):
+        # (features, CPUs) that imply the given feature, or None if there is no such feature.
+        feature = self.feature_by_name.get(feature_name)
+        if feature is None:
+            return None
+
+        return self.feature_names_of(self.implied_by[feature]), self.cpu_names_of(self.cpus_by_feature[feature])
+
+    def minimal_cpus(self, feature_names):
+        # CPUs supporting all of the given features, with the fewest other features; unknown
+        # feature names support no CPU. Returns a sorted list of CPU names.
+        candidates = (1 << len(self.cpu_names)) - 1
+        for name in feature_names:
+            feature = self.feature_by_name.get(name)
+            if feature is None:
+                return []
+            candidates &= self.cpus_by_feature[feature]
+
+        best = []
+        best_size = None
+        for cpu in iter_set_bits(candidates):
+            size = bin(self.cpu_closures[cpu]).count("1")
+            if best_size is None or size < best_size:
+                best = [cpu]
+                best_size = size
+            elif size == best_size:
+                best.append(cpu)
+
+        return sorted(self.cpu_names[cpu] for cpu in best)
+
+
+def details_files(details_dir):
+    # Maps arch names to their details file in details_dir, preferring binary details over JSON.
+    # Only files named after a target count, as the dir may hold other JSON (e.g. a trace).
+    arch_names = {target.output_name for target in TARGETS}
+    files = {}
+    for path in sorted(glob.glob(os.path.join(details_dir, "*.json")) + glob.glob(os.path.join(details_dir, "*.bin"))):
+        arch_name, suffix = os.path.splitext(os.path.basename(path))
+        if arch_name not in arch_names:
+            continue
+
+        if suffix == ".bin" or arch_name not in files:
+            files[arch_name] = path
+
+    return files
+
+
+def load_details(path):
+    if path.endswith(".bin"):
+        with DetailsFile(path) as details_file:
+            return details_file.to_details()
+
+    with open(path, "r") as f:
+        return TargetDetails.from_json(json.load(f))
+
+
+class IndexDatabase:
+    # Persists ArchIndexes in SQLite, keyed on the digest of the details file they were built from.
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS arches (
+                name TEXT PRIMARY KEY, source_digest TEXT NOT NULL, version INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS features (
+                arch TEXT NOT NULL, idx INTEGER NOT NULL, llvm_name TEXT NOT NULL,
+                closure BLOB NOT NULL, implied_by BLOB NOT NULL, cpus BLOB NOT NULL,
+                PRIMARY KEY (arch, idx));
+            CREATE TABLE IF NOT EXISTS cpus (
+                arch TEXT NOT NULL, idx INTEGER NOT NULL, llvm_name TEXT NOT NULL, closure BLOB NOT NULL,
+                PRIMARY KEY (arch, idx));
+        """)
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, arch_name, source_digest):
+        # Returns the stored ArchIndex for the arch, or None if it is missing or out of date.
+        row = self.connection.execute("SELECT source_digest, version FROM arches WHERE name = ?", (arch_name,)).fetchone()
+        if row is None or row[0] != source_digest or row[1] != INDEX_VERSION:
+            return None
+
+        features = self.connection.execute(
+            "SELECT llvm_name, closure, implied_by, cpus FROM features WHERE arch = ? ORDER BY idx", (arch_name,)).fetchall()
+        cpus = self.connection.execute(
+            "SELECT llvm_name, closure FROM cpus WHERE arch = ? ORDER BY idx", (arch_name,)).fetchall()
+
+        return ArchIndex(
+            arch_name,
+            [row[0] for row in features],
+            [row[0] for row in cpus],
+            [blob_to_mask(row[1]) for row in features],
+            [blob_to_mask(row[1]) for row in cpus],
+            [blob_to_mask(row[2]) for row in features],
+            [blob_to_mask(row[3]) for row in features])
+
+    def store(self, index, source_digest):
+        with self.connection:
+            name = index.arch_name
+            self.connection.execute("DELETE FROM features WHERE arch = ?", (name,))
+            self.connection.execute("DELETE FROM cpus WHERE arch = ?", (name,))
+            self.connection.execute("INSERT OR REPLACE INTO arches VALUES (?, ?, ?)", (name, source_digest, INDEX_VERSION))
+
+            self.connection.executemany(
+                "INSERT INTO features VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (name, i, index.feature_names[i],
+                        mask_to_blob(index.feature_closures[i]), mask_to_blob(index.implied_by[i]), mask_to_blob(index.cpus_by_feature[i]))
+                    for i in range(len(index.feature_names))
+                ])
+            self.connection.executemany(
+                "INSERT INTO cpus VALUES (?, ?, ?, ?)",
+                [(name, i, index.cpu_names[i], mask_to_blob(index.cpu_closures[i])) for i in range(len(index.cpu_names))])
+
+
+def load_indexes(details_dir, index_path=None, arch_names=None):
+    # Returns a dict of arch name to ArchIndex for the details in details_dir, optionally limited
+    # to the given arches. If index_path is given, indexes are loaded from and saved to it.
+    files = details_files(details_dir)
+    if arch_names is not None:
+        for arch_name in arch_names:
+            if arch_name not in files:
+                print("[!] No details for arch {} in {}!".format(arch_name, details_dir), file=sys.stderr)
+                sys.exit(1)
+        files = {arch_name: files[arch_name] for arch_name in arch_names}
+
+    database = IndexDatabase(index_path) if index_path is not None else None
+
+    indexes = {}
+    try:
+        for arch_name, path in files.items():
+            index = None
+            if database is not None:
+                source_digest = file_digest(path)
+                index = database.load(arch_name, source_digest)
+
+            if index is None:
+                index = ArchIndex.build(arch_name, load_details(path))
+                if database is not None:
+                    database.store(index, source_digest)
+
+            indexes[arch_name] = index
+    finally:
+        if database is not None:
+            database.close()
+
+    return indexes
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Query generated target details: feature closures, reverse dependencies and minimal CPUs.",
+        allow_abbrev=False)
+
+    arg_parser.add_argument(
+        "details_dir",
+        help="directory containing <arch>.bin or <arch>.json details, as written by gen.py -output-details-bin or -output-details-json")
+    arg_parser.add_argument(
+        "-index",
+        default=None,
+        help="(default: <none>) SQLite file in which to keep the indexes between runs")
+
+    subparsers = arg_parser.add_subparsers(dest="query", required=True)
+
+    closure_parser = subparsers.add_parser("closure", help="list every feature a CPU or feature implies")
+    closure_parser.add_argument("arch")
+    closure_parser.add_argument("name", help="LLVM name of a CPU or feature")
+
+    implied_by_parser = subparsers.add_parser("implied-by", help="list the features and CPUs that imply a feature, across arches")
+    implied_by_parser.add_argument("feature", help="LLVM name of a feature")
+    implied_by_parser.add_argument("-arch", default=None, help="(default: all arches) only search this arch")
+
+    minimal_cpu_parser = subparsers.add_parser("minimal-cpu", help="find the CPUs with the fewest features that support all the given features")
+    minimal_cpu_parser.add_argument("arch")
+    minimal_cpu_parser.add_argument("features", nargs="+", help="LLVM names of features")
+
+    args = arg_parser.parse_args()
+
+    if args.query == "closure":
+        index = load_indexes(args.details_dir, args.index, [args.arch])[args.arch]
+        closure = index.closure(args.name)
+        if closure is None:
+            print("[!] {} has no CPU or feature named {}!".format(args.arch, args.name), file=sys.stderr)
+            sys.exit(1)
+
+        for name in sorted(closure):
+            print(name)
+
+    elif args.query == "implied-by":
+        arch_names = None if args.arch is None else [args.arch]
+        found = False
+        for arch_name, index in load_indexes(args.details_dir, args.index, arch_names).items():
+            result = index.reverse_dependencies(args.feature)
+            if result is None:
+                continue
+
+            found = True
+            features, cpus = result
+            print("= {}".format(arch_name))
+            print("  features: {}".format(" ".join(sorted(features)) or "(none)"))
+            print("  cpus: {}".format(" ".join(sorted(cpus)) or "(none)"))
+
+        if not found:
+            print("[!] No arch has a feature named {}!".format(args.feature), file=sys.stderr)
+            sys.exit(1)
+
+    elif args.query == "minimal-cpu":
+        index = load_indexes(args.details_dir, args.index, [args.arch])[args.arch]
+        cpus = index.minimal_cpus(args.features)
+        if len(cpus) == 0:
+            print("[!] No {} CPU supports all of: {}".format(args.arch, " ".join(args.features)), file=sys.stderr)
+            sys.exit(1)
+
+        for name in cpus:
+            print(name)
+
+
+if __name__ == "__main__":
+    main()
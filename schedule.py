@@ -0,0 +1,196 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+# Scheduling of targets across worker threads, using how long each target took in earlier runs.
+#
+# Targets with the longest history run first (longest processing time first), so that the last
+# targets to finish are short ones rather than a single long tablegen run keeping one core busy.
+# Tablegen processes are further capped by CPU cores and by the memory each one needed before.
+
+import contextlib
+import json
+import os
+import threading
+
+from output_manifest import write_if_changed
+
+# Name of the history file, stored in the work dir (or the cache dir if there is none).
+HISTORY_FILE_NAME = ".gen_history.json"
+
+
+def cpu_cores():
+    # Number of CPU cores this process may run on.
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_kb():
+    # Memory available to new processes, in KB, or None if the platform cannot report it.
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class BuildHistory:
+    # Per-target stage durations (in seconds) and tablegen peak memory from the last run that
+    # processed each target. Targets that were skipped as up to date keep their earlier entry.
+    # Without a directory, nothing is loaded or saved.
+
+    def __init__(self, directory):
+        self.path = None
+        self.entries = {}
+        if directory is None:
+            return
+
+        self.path = os.path.join(directory, HISTORY_FILE_NAME)
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def estimate(self, name):
+        # Expected seconds of work for the target, or None if it has no history.
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return sum(entry["stages"].values())
+
+    def tablegen_rss_kb(self, name):
+        # Peak memory of the target's last tablegen run, in KB, or None if unknown.
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return entry.get("tablegen_max_rss_kb")
+
+    def record(self, name, stage_durations, tablegen_rss_kb=None):
+        if tablegen_rss_kb is None:
+            tablegen_rss_kb = self.tablegen_rss_kb(name)
+
+        self.entries[name] = {"stages": stage_durations}
+        if tablegen_rss_kb is not None:
+            self.entries[name]["tablegen_max_rss_kb"] = tablegen_rss_kb
+
+    def save(self):
+        if self.path is None:
+            return
+
+        data = json.dumps(self.entries, indent=4, sort_keys=True).encode()
+        write_if_changed(self.path, data)
+
+
+class TablegenLimiter:
+    # Caps the number of tablegen processes running at once: at most one per CPU core, and only
+    # as many as fit in the memory available when the run started, going by each target's peak
+    # memory in earlier runs. A single process is always allowed to run, however large.
+
+    def __init__(self, max_processes=None, memory_budget_kb=None):
+        self.max_processes = max_processes or cpu_cores()
+        self.memory_budget_kb = memory_budget_kb
+
+        self._condition = threading.Condition()
+        self._running = 0
+        self._memory_kb = 0
+
+    def _fits(self, rss_kb):
+        if self._running == 0:
+            return True
+        if self._running >= self.max_processes:
+            return False
+        if self.memory_budget_kb is None or rss_kb is None:
+            return True
+        return self._memory_kb + rss_kb <= self.memory_budget_kb
+
+    @contextlib.contextmanager
+    def slot(self, rss_kb=None, on_wait=None):
+        # Holds a slot for one tablegen process expected to need rss_kb of memory. If the slot
+        # is not available right away, on_wait is called before blocking.
+        rss_kb = rss_kb or 0
+
+        with self._condition:
+            if not self._fits(rss_kb):
+                if on_wait is not None:
+                    on_wait()
+                while not self._fits(rss_kb):
+                    self._condition.wait()
+
+            self._running += 1
+            self._memory_kb += rss_kb
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._memory_kb -= rss_kb
+                self._condition.notify_all()
+
+
+def longest_first(items, estimate):
+    # Orders items by descending estimate. Items without one come first, as nothing rules out
+    # their being the slowest; ties keep their original order.
+    def key(item):
+        seconds = estimate(item)
+        return (seconds is not None, -(seconds or 0))
+
+    return sorted(items, key=key)
+
+
+def expected_critical_path(names_and_estimates, workers):
+    # Simulates list scheduling of (name, seconds) items in the given order on `workers` workers,
+    # each taking the next item as it becomes free. Returns (seconds, names) of the worker that
+    # finishes last: the run's expected critical path.
+    lanes = [(0.0, []) for _ in range(max(1, min(workers, len(names_and_estimates))))]
+
+    for name, seconds in names_and_estimates:
+        index = min(range(len(lanes)), key=lambda i: lanes[i][0])
+        finish, names = lanes[index]
+        lanes[index] = (finish + seconds, names + [name])
+
+    return max(lanes, key=lambda lane: lane[0])
+
+
+def actual_critical_path(runs):
+    # Given (name, start, end, worker) of each item that ran, returns (seconds, names) of the
+    # worker that finished last, measured from the start of the first item.
+    if len(runs) == 0:
+        return 0.0, []
+
+    run_start = min(start for _, start, _, _ in runs)
+    last_worker = max(runs, key=lambda run: run[2])[3]
+
+    lane = sorted((run for run in runs if run[3] == last_worker), key=lambda run: run[1])
+    return lane[-1][2] - run_start, [name for name, _, _, _ in lane]
+
+
+def format_critical_path(seconds, names):
+    return "{:.1f}s ({})".format(seconds, " -> ".join(names))
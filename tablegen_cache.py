@@ -0,0 +1,430 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import contextlib
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from output_manifest import file_digest, write_if_changed
+
+# fcntl is only available on Unix-like systems. Without it, entries are not locked, so runs
+# sharing a cache dir may duplicate work (but still never see partially written entries).
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump this to invalidate every existing cache entry.
+CACHE_VERSION = 1
+
+# Suffix to use for cached tablegen output files.
+TABLEGEN_FILE_SUFFIX = "_tablegen.cpp"
+
+# Suffix of cached tablegen --dump-json output files.
+TABLEGEN_JSON_FILE_SUFFIX = "_tablegen.json"
+
+# Suffix of the file next to each tablegen output file holding the digest of its contents.
+DIGEST_FILE_SUFFIX = ".sha256"
+
+# Suffix to use for cached details files.
+DETAILS_FILE_SUFFIX = ".json"
+
+# Temporary files older than this (in seconds) are left over from interrupted runs, and are
+# removed by eviction.
+TEMP_FILE_MAX_AGE = 24 * 60 * 60
+
+include_re = re.compile(r'^\s*include\s+"(?P<path>[^"]+)"', re.MULTILINE)
+
+
+def default_cache_dir():
+    # Persistent per-user location, used when neither -cache-dir nor -work-dir is given.
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "zig-llvm-target-details")
+
+
+def tblgen_identity(tblgen_path):
+    # Identifies a tablegen executable: its resolved location, size, modification time and
+    # reported version. Any of these changing (e.g. after an LLVM bump) changes all cache keys.
+    resolved = shutil.which(tblgen_path) or tblgen_path
+    resolved = os.path.realpath(resolved)
+
+    stat = os.stat(resolved)
+
+    version = subprocess.run(
+        [resolved, "--version"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True).stdout
+
+    return "{}\n{}\n{}\n{}".format(resolved, stat.st_size, stat.st_mtime_ns, version.strip())
+
+
+class TablegenInputs:
+    # Computes content hashes of the inputs to a tablegen run: the tablegen executable identity,
+    # the tablegen command line and the contents of the root .td file together with everything it
+    # transitively includes.
+    #
+    # Includes are discovered by scanning the .td sources, which lets the hash be computed without
+    # running tablegen. Scanning over-approximates (e.g. includes inside comments are followed),
+    # which can only cause a spurious mismatch, never a stale match.
+
+    def __init__(self, tblgen_identity):
+        self.tblgen_identity = tblgen_identity
+
+        # Maps absolute .td paths to (content digest, include names).
+        # Shared between targets, since most of them include the same files under include/llvm.
+        self._file_info = {}
+
+    def _scan_file(self, path):
+        info = self._file_info.get(path)
+        if info is None:
+            with open(path, "rb") as f:
+                contents = f.read()
+
+            digest = hashlib.sha256(contents).hexdigest()
+            includes = include_re.findall(contents.decode("utf-8", errors="replace"))
+
+            info = (digest, includes)
+            self._file_info[path] = info
+
+        return info
+
+    def _resolve_dependencies(self, target_dir, td_name, include_dirs):
+        # Returns a dict mapping the include name of the root .td file and each of its transitive
+        # includes to the path it resolves to, or None if it cannot be found.
+        search_dirs = [target_dir] + [os.path.join(target_dir, d) for d in include_dirs]
+
+        paths = {}
+        pending = [(td_name, target_dir)]
+
+        while len(pending) > 0:
+            name, including_dir = pending.pop()
+            if name in paths:
+                continue
+
+            path = None
+            for search_dir in [including_dir] + search_dirs:
+                candidate = os.path.normpath(os.path.join(search_dir, name))
+                if os.path.isfile(candidate):
+                    path = candidate
+                    break
+
+            paths[name] = path
+            if path is None:
+                continue
+
+            _, includes = self._scan_file(path)
+            for include in includes:
+                pending.append((include, os.path.dirname(path)))
+
+        return paths
+
+    def td_dependencies(self, target_dir, td_name, include_dirs):
+        # Returns a sorted list of (include name, content digest) for the root .td file and all
+        # of its transitive includes. Names are kept as spelled in the sources, so identical
+        # trees at different locations produce identical keys.
+        deps = []
+        for name, path in self._resolve_dependencies(target_dir, td_name, include_dirs).items():
+            # tablegen will report a missing file itself; record it so the key still changes if it appears.
+            digest = "missing" if path is None else self._scan_file(path)[0]
+            deps.append((name, digest))
+
+        return sorted(deps)
+
+    def td_paths(self, target_dir, td_name, include_dirs):
+        # Returns the paths of the root .td file and all of its transitive includes.
+        paths = self._resolve_dependencies(target_dir, td_name, include_dirs).values()
+        return sorted(path for path in paths if path is not None)
+
+    def forget(self, paths):
+        # Drops remembered contents of the given files, e.g. after they have been modified.
+        for path in paths:
+            self._file_info.pop(path, None)
+
+    def key(self, target_dir, td_name, flags, include_dirs):
+        hasher = hashlib.sha256()
+        hasher.update("v{}\n".format(CACHE_VERSION).encode())
+        hasher.update(self.tblgen_identity.encode())
+        hasher.update("\n".join(flags).encode())
+
+        for name, digest in self.td_dependencies(target_dir, td_name, include_dirs):
+            hasher.update("\n{} {}".format(name, digest).encode())
+
+        return hasher.hexdigest()
+
+
+class TablegenCache:
+    # Content-addressed store of tablegen output, keyed by TablegenInputs.key(), and of the
+    # target details resolved from it, keyed by details_key().
+    #
+    # A cache dir can be shared by concurrent runs. Entries are written to temporary files and
+    # renamed into place, so they appear complete or not at all. Producing a tablegen entry
+    # happens under a per-entry lock, so that only one run computes it while the others wait
+    # and reuse it. Reading entries takes no lock: an entry deleted by eviction while it is
+    # open stays readable, and one deleted before it is opened is simply a miss.
+    #
+    # Entries are marked as used (by their modification time) on every hit, and evict() removes
+    # the least recently used ones to bound the cache's size.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.tablegen_dir = os.path.join(cache_dir, "tablegen")
+        self.details_dir = os.path.join(cache_dir, "details")
+        self.locks_dir = os.path.join(cache_dir, "locks")
+
+        os.makedirs(self.tablegen_dir, exist_ok=True)
+        os.makedirs(self.details_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+    def path(self, name, key, suffix=TABLEGEN_FILE_SUFFIX):
+        return os.path.join(self.tablegen_dir, "{}-{}{}".format(name, key, suffix))
+
+    def lookup(self, name, key, suffix=TABLEGEN_FILE_SUFFIX):
+        path = self.path(name, key, suffix)
+        if os.path.isfile(path):
+            return path
+        return None
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def open_entry(self, name, key, suffix=TABLEGEN_FILE_SUFFIX):
+        # Opens a cached tablegen output for reading (in binary mode) and marks it as used, or
+        # returns None if it is not cached.
+        path = self.path(name, key, suffix)
+        try:
+            entry_file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        self._touch(path)
+        return entry_file
+
+    def _lock_path(self, path):
+        return os.path.join(self.locks_dir, os.path.basename(path) + ".lock")
+
+    @contextlib.contextmanager
+    def lock(self, path, on_wait=None):
+        # Holds an exclusive lock on the entry at `path` (which need not exist yet). If another
+        # run holds it, on_wait() is called before blocking until it is released.
+        if fcntl is None:
+            yield
+            return
+
+        lock_path = self._lock_path(path)
+        waited = False
+        while True:
+            lock_file = open(lock_path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if on_wait is not None and not waited:
+                    on_wait()
+                waited = True
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            # Eviction removes lock files (while holding them), so the file locked here may no
+            # longer be the one at lock_path, in which case another run can lock that one too.
+            try:
+                lock_stat = os.stat(lock_path)
+                current = os.path.samestat(os.fstat(lock_file.fileno()), lock_stat)
+            except FileNotFoundError:
+                current = False
+
+            if current:
+                break
+            lock_file.close()
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _remove_entry(self, path):
+        # Removes an entry, its digest and its lock file, unless a run holds its lock (e.g.
+        # because it is producing the entry). Returns True if the entry was removed.
+        lock_file = None
+        if fcntl is not None:
+            with contextlib.suppress(OSError):
+                lock_file = open(self._lock_path(path), "r")
+
+        try:
+            if lock_file is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            with contextlib.suppress(OSError):
+                os.remove(path + DIGEST_FILE_SUFFIX)
+
+            if lock_file is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(self._lock_path(path))
+
+            return True
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def new_entry_file(self, name):
+        # Opens a temporary file in the cache directory. Once fully written, it is moved
+        # into place with publish(), so readers never observe a partially written entry.
+        fd, temp_path = tempfile.mkstemp(prefix=name + "-", suffix=".tmp", dir=self.tablegen_dir)
+        return os.fdopen(fd, "wb"), temp_path
+
+    def publish(self, temp_path, name, key, suffix=TABLEGEN_FILE_SUFFIX):
+        # The digest of the output is stored first, so a published entry always has one.
+        path = self.path(name, key, suffix)
+        write_if_changed(path + DIGEST_FILE_SUFFIX, file_digest(temp_path).encode())
+        os.replace(temp_path, path)
+        return path
+
+    def output_digest(self, name, key, suffix=TABLEGEN_FILE_SUFFIX):
+        # Digest of the contents of a cached tablegen output, or None if it is not cached.
+        path = self.lookup(name, key, suffix)
+        if path is None:
+            return None
+
+        try:
+            with open(path + DIGEST_FILE_SUFFIX, "r") as f:
+                return f.read().strip()
+        except OSError:
+            # Entries from before digests were stored.
+            digest = file_digest(path)
+            if digest is not None:
+                write_if_changed(path + DIGEST_FILE_SUFFIX, digest.encode())
+            return digest
+
+    def details_path(self, name, details_key):
+        return os.path.join(self.details_dir, "{}-{}{}".format(name, details_key, DETAILS_FILE_SUFFIX))
+
+    def lookup_details(self, name, details_key):
+        # Returns the cached details JSON (bytes) and marks it as used, or returns None.
+        path = self.details_path(name, details_key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        self._touch(path)
+        return data
+
+    def store_details(self, name, details_key, data):
+        write_if_changed(self.details_path(name, details_key), data)
+
+    def evict(self, max_bytes):
+        # Removes least recently used entries until the cache holds at most max_bytes, along
+        # with stale temporary files. Returns (entries removed, bytes freed). If another run
+        # is already evicting, does nothing.
+        if fcntl is not None:
+            with open(os.path.join(self.locks_dir, "evict.lock"), "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0, 0
+
+                try:
+                    return self._evict(max_bytes)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        return self._evict(max_bytes)
+
+    def _evict(self, max_bytes):
+        now = time.time()
+        entries = []
+
+        for entries_dir in (self.tablegen_dir, self.details_dir):
+            for dir_entry in os.scandir(entries_dir):
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+
+                if dir_entry.name.endswith(".tmp"):
+                    if now - stat.st_mtime > TEMP_FILE_MAX_AGE:
+                        with contextlib.suppress(OSError):
+                            os.remove(dir_entry.path)
+                    continue
+
+                if dir_entry.name.endswith(DIGEST_FILE_SUFFIX):
+                    # Counted and removed along with its entry.
+                    continue
+
+                size = stat.st_size
+                digest_path = dir_entry.path + DIGEST_FILE_SUFFIX
+                with contextlib.suppress(OSError):
+                    size += os.path.getsize(digest_path)
+
+                entries.append((stat.st_mtime, size, dir_entry.path))
+
+        total = sum(size for _, size, _ in entries)
+
+        removed = 0
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+
+            if not self._remove_entry(path):
+                continue
+
+            total -= size
+            removed += 1
+            freed += size
+
+        # Lock files of entries that are gone (e.g. never published, or evicted before lock
+        # files were removed along with them).
+        for dir_entry in os.scandir(self.locks_dir):
+            if not dir_entry.name.endswith(".lock") or dir_entry.name == "evict.lock":
+                continue
+
+            entry_path = os.path.join(self.tablegen_dir, dir_entry.name[:-len(".lock")])
+            if not os.path.exists(entry_path):
+                self._remove_entry(entry_path)
+
+        return removed, freed
+
+
+def details_key(output_digest, blacklist, resolver_digest):
+    # Key of the details resolved from a tablegen output with the given digest, for an arch with
+    # the given blacklist. resolver_digest identifies the parsing and resolving code.
+    hasher = hashlib.sha256()
+    hasher.update("v{}\n".format(CACHE_VERSION).encode())
+    hasher.update(resolver_digest.encode())
+    hasher.update("\n{}\n".format(output_digest).encode())
+    hasher.update("\n".join(sorted(blacklist)).encode())
+    return hasher.hexdigest()
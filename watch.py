@@ -0,0 +1,100 @@
+"""
+Copyright (c) 2020 Layne Gustafson.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import time
+
+
+def file_signature(path):
+    # Cheap stand-in for a file's contents: modification time and size, or None if it is missing.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class Watcher:
+    # Polls a set of files for changes.
+    #
+    # Each watched path belongs to one or more owners (e.g. the targets whose .td files include
+    # it), so that a change can be mapped back to the owners it affects. Polling is used rather
+    # than inotify and friends to stay portable and dependency-free; stat()ing a few hundred
+    # .td files twice a second is cheap.
+
+    def __init__(self, poll_interval=0.5, quiet_period=0.3):
+        self.poll_interval = poll_interval
+        self.quiet_period = quiet_period
+
+        self._owners = {}
+        self._signatures = {}
+
+    def set_paths(self, owner, paths):
+        # Replaces the set of paths watched on behalf of `owner`.
+        for owners in self._owners.values():
+            owners.discard(owner)
+
+        for path in paths:
+            self._owners.setdefault(path, set()).add(owner)
+            if path not in self._signatures:
+                self._signatures[path] = file_signature(path)
+
+        for path in [path for path, owners in self._owners.items() if len(owners) == 0]:
+            del self._owners[path]
+            del self._signatures[path]
+
+    def owners(self, paths):
+        result = set()
+        for path in paths:
+            result |= self._owners.get(path, set())
+        return result
+
+    def _poll(self):
+        changed = set()
+        for path in self._owners:
+            signature = file_signature(path)
+            if signature != self._signatures[path]:
+                self._signatures[path] = signature
+                changed.add(path)
+
+        return changed
+
+    def wait_for_changes(self):
+        # Blocks until at least one watched file changes, then keeps collecting changes until
+        # none have been seen for the quiet period, so that an editor saving several files (or
+        # writing one file in several steps) triggers a single rebuild. Returns the changed paths.
+        changed = set()
+        while len(changed) == 0:
+            time.sleep(self.poll_interval)
+            changed = self._poll()
+
+        last_change = time.monotonic()
+        while time.monotonic() - last_change < self.quiet_period:
+            time.sleep(min(self.poll_interval, self.quiet_period))
+
+            more = self._poll()
+            if len(more) > 0:
+                changed |= more
+                last_change = time.monotonic()
+
+        return changed